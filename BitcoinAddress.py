@@ -3,11 +3,11 @@ import myecdsa
 from hashing import *
 import base58
 import bech32
-import re
 import convert
 import struct
 import binascii
 import hashlib
+from functools import cached_property
 
 def byt(c):
     return struct.pack("<B", c)
@@ -61,18 +61,7 @@ class Address:
     @staticmethod
     def frombase58(b58):
         self= Address()
-        data= base58.decode(b58)
-        if len(data)>25:
-            print("addr len > 25: %s" % binascii.b2a_hex(data))
-            raise Exception("Invalid base58 length")
-        if len(data)<25:
-            data= "\x00" * (25-len(data))
-        self.version= ord(data[0:1])
-        self.hash= data[1:21]
-        if shasha(data[0:21])[:4] != data[21:]:
-            print("addr: %s: %s != %s" % (binascii.b2a_hex(data[:21]), binascii.b2a_hex(data[21:]), shasha(data[0:21])[:4]))
-            raise Exception("Invalid base58 checksum")
-
+        self.version, self.hash = base58.base58check_decode(b58, (20,))
         return self
 
     @staticmethod
@@ -148,20 +137,13 @@ class PrivateKey:
     @staticmethod
     def fromwallet(b58):
         self= PrivateKey()
-        data= base58.decode(b58)
-        if not len(data) in (37, 38):
-            print("wallet len != 37/38: %s" % binascii.b2a_hex(data))
-            raise Exception("Invalid wallet length")
-        self.version= ord(data[0:1])
-        self.privkey= convert.numfrombytes(data[1:33])
-
-        if len(data)==38:
+        self.version, data = base58.base58check_decode(b58, (32, 33))
+        self.privkey= convert.numfrombytes(data[:32])
+
+        if len(data)==33:
             # a compressed walled has:
             # <wallet-tag>  <32-byte-privkey>  <01>  <4-byte-hash>
-            self.compressed= ord(data[33:34])
-        if shasha(data[:-4])[:4] != data[-4:]:
-            print("wallet: %s: %s != %s" % (binascii.b2a_hex(data[:33]), binascii.b2a_hex(data[33:]), shasha(data[0:33])[:4]))
-            raise Exception("Invalid base58 checksum")
+            self.compressed= data[32]
 
         return self
 
@@ -220,52 +202,97 @@ class WSH:
     def dump(self):
         print("%-32s: - %s" % (binascii.b2a_hex(self.hash).decode('ascii'), self.bech32()))
 
+_hexchars = frozenset("0123456789abcdefABCDEF")
+_b58chars = frozenset(base58.charset)
+_b32chars = frozenset(bech32.alphabet)
+
+def _ishex(arg):
+    return _hexchars.issuperset(arg)
+
+def _isb58(arg):
+    return _b58chars.issuperset(arg)
+
+def _isb32(arg):
+    i = arg.rfind('1')
+    return (i != 0) and _b32chars.issuperset(arg[i+1:]) and (i < 0 or arg[:i].isalnum())
+
 """
 represent all components of a bitcoin address combined
 """
 class BitcoinAddress:
+    """
+    The derived forms: pubkey, compaddr, fulladdr, p2sh, p2shfull, p2wsh and bech32
+    are calculated when first used.
+    """
     def __init__(self, arg):
+        self.privkey= None
         if isinstance(arg, PrivateKey):
             self.privkey= arg
         elif isinstance(arg, PublicKey):
-            self.privkey= None
             self.pubkey= arg
         elif isinstance(arg, Address):
-            self.privkey= None
             self.pubkey= None
             self.compaddr = self.fulladdr = arg
         else:
-            self.privkey= None
             self.pubkey= None
             self.compaddr = self.fulladdr = None
-            self.p2sh = None
-            self.p2shfull = None
 
+    @cached_property
+    def pubkey(self):
         if self.privkey:
-            self.pubkey= self.privkey.publickey()
-        if  self.pubkey:
-            self.compaddr= Address.fromhash(sharip(self.pubkey.compressed()))
-            self.fulladdr= Address.fromhash(sharip(self.pubkey.uncompressed()))
-            if self.privkey and self.privkey.version:
-                # most coins have walletversion = 128 + addressversion
-                if self.privkey.version >= 128:
-                    self.compaddr.version= self.privkey.version-128
-                    self.fulladdr.version= self.privkey.version-128
-                else:
-                    print("WARNING: privkey has invalid version: 0x%02x, should be >= 0x80" % self.privkey.version)
-                    self.compaddr.version= self.privkey.version
-                    self.fulladdr.version= self.privkey.version
+            return self.privkey.publickey()
+
+    @cached_property
+    def addrversion(self):
+        """ the address version implied by the privkey, or None """
+        if self.privkey and self.privkey.version:
+            # most coins have walletversion = 128 + addressversion
+            if self.privkey.version >= 128:
+                return self.privkey.version-128
+            print("WARNING: privkey has invalid version: 0x%02x, should be >= 0x80" % self.privkey.version)
+            return self.privkey.version
+
+    def pubkeyaddress(self, pubkey):
+        addr = Address.fromhash(sharip(pubkey))
+        if self.addrversion is not None:
+            addr.version = self.addrversion
+        return addr
+
+    @cached_property
+    def compaddr(self):
+        if self.pubkey:
+            return self.pubkeyaddress(self.pubkey.compressed())
+
+    @cached_property
+    def fulladdr(self):
+        if self.pubkey:
+            return self.pubkeyaddress(self.pubkey.uncompressed())
+
+    @staticmethod
+    def p2shaddress(addr):
+        p2sh = Address.fromhash(sharip(struct.pack(">H", len(addr.hash))+addr.hash))
+        p2sh.version = 5
+        return p2sh
+
+    @cached_property
+    def p2sh(self):
         if self.compaddr:
-            self.p2sh = Address.fromhash(sharip(struct.pack(">H", len(self.compaddr.hash))+self.compaddr.hash))
-            self.p2sh.version = 5
+            return self.p2shaddress(self.compaddr)
+
+    @cached_property
+    def p2shfull(self):
         if self.fulladdr:
-            self.p2shfull = Address.fromhash(sharip(struct.pack(">H", len(self.fulladdr.hash))+self.fulladdr.hash))
-            self.p2shfull.version = 5
+            return self.p2shaddress(self.fulladdr)
 
-        self.p2wsh = None
+    @cached_property
+    def p2wsh(self):
         if self.pubkey:
-            self.p2wsh = WSH.frompubkey(self.pubkey.compressed())
+            return WSH.frompubkey(self.pubkey.compressed())
 
+    @cached_property
+    def bech32(self):
+        if self.compaddr:
+            return self.compaddr.bech32()
 
     @staticmethod
     def from_privkey(arg):
@@ -290,42 +317,39 @@ class BitcoinAddress:
     def from_bech32(arg):
         return BitcoinAddress(Address.frombech32(arg))
     @staticmethod
-    def from_auto(arg):
-        ishex= re.match(r'[0-9a-fA-F]+$', arg)
-        isb58= re.match(r'['+base58.charset+']+$', arg)
-        isb32= re.match(r'(?:\w+1)?['+bech32.alphabet+']+$', arg)
-
-        if len(arg)==51 and arg[0]=='5' and 'H' <= arg[1] <= 'K' and isb58:
+    def classify(arg):
+        """
+        determine the kind of string, returns one of:
+            wallet, base58, bech32, pubkey, hash, privkey, or None
+        only the character set matching the length and prefix is checked.
+        """
+        n = len(arg)
+        if n==51 and arg[0]=='5' and 'H' <= arg[1] <= 'K' or n==52 and "Kw" <= arg[:2] <='L5':
             # a wallet private key
-            return BitcoinAddress.from_wallet(arg)
-        if len(arg)==52 and "Kw" <= arg[:2] <='L5' and isb58:
-            # a wallet private key
-            return BitcoinAddress.from_wallet(arg)
-        elif 31<=len(arg)<=34 and arg[0]=='1' and isb58:
-            # a 'p2pkh' address
-            return BitcoinAddress.from_base58(arg)
-        elif 31<=len(arg)<=34 and arg[0]=='3' and isb58:
-            # a 'p2sh' address
-            return BitcoinAddress.from_base58(arg)
-        elif len(arg)==42 and isb32:
-            # a 'p2wpkh' address
-            return BitcoinAddress.from_bech32(arg)
-        elif len(arg)==62 and isb32:
-            # a 'p2wsh' address
-            return BitcoinAddress.from_bech32(arg)
-        elif len(arg)==130 and arg[:2]=='04' and ishex:
-            # a full public key
-            return BitcoinAddress.from_pubkey(arg)
-        elif len(arg)==40 and ishex:
-            return BitcoinAddress.from_hash(arg)
-        elif len(arg)==66 and arg[0]=='0' and arg[1] in ('2','3') and ishex:
-            # a compressed public key
-            return BitcoinAddress.from_pubkey(arg)
-        elif len(arg)==64 and ishex:
-            # a hex private key
-            return BitcoinAddress(PrivateKey.fromprivkey(binascii.a2b_hex(arg)))
-        else:
-            print("unknown string: %s" % arg)
+            return "wallet" if _isb58(arg) else None
+        if 31<=n<=34 and arg[0] in "13":
+            # a 'p2pkh' or 'p2sh' address
+            return "base58" if _isb58(arg) else None
+        if n==42 or n==62:
+            # a 'p2wpkh' or 'p2wsh' address
+            if _isb32(arg):
+                return "bech32"
+        if n in (40, 64, 66, 130) and _ishex(arg):
+            if n==40:
+                return "hash"
+            if n==64:
+                # a hex private key
+                return "privkey"
+            if n==66 and arg[0]=='0' and arg[1] in ('2','3') or n==130 and arg[:2]=='04':
+                # a compressed or full public key
+                return "pubkey"
+
+    @staticmethod
+    def from_auto(arg):
+        kind = BitcoinAddress.classify(arg)
+        if kind:
+            return getattr(BitcoinAddress, "from_" + kind)(arg)
+        print("unknown string: %s" % arg)
 
     def dump(self):
         if self.privkey: self.privkey.dump()
@@ -0,0 +1,282 @@
+"""
+A memory mapped index of address hashes, for membership tests against large address lists.
+
+Addresses are decoded to their hash: 20 bytes for p2pkh, p2sh and p2wpkh,
+32 bytes for p2wsh and p2tr. Each hash size is stored in its own file:
+    <name>.20 and <name>.32:
+        header:     "ADIX"  <L version>  <L hashsize>  <Q nrecords>
+        records:    the sorted, unique hashes
+    <name>.20.bloom and <name>.32.bloom:
+        header:     "ABLM"  <L version>  <Q nbits>  <L nhashes>
+        the bloom filter bits
+
+The hashes are sorted externally: they are decoded in batches, each batch is sorted
+into a temporary run file, and the runs are merged into the index file.
+
+A lookup first checks the bloom filter, most hashes not in the list stop there.
+Other hashes are looked up with a binary search in the mmapped file.
+Since the files are only read, several processes share them through the page cache.
+
+usage:
+    python3 addrindex.py --index watch --build addresses.txt
+    python3 addrindex.py --index watch 1BvBMSEYstWetqTFn5Au4m4GFg7xJaNVN2 77bff20c60e522dfaa3350c39b030a5d004e839a
+"""
+from __future__ import print_function, division
+import heapq
+import math
+import mmap
+import os
+import struct
+import tempfile
+
+from BitcoinAddress import Address, BitcoinAddress
+
+MAGIC = b"ADIX"
+HEADER = struct.Struct("<4sLLQ")
+BLOOMMAGIC = b"ABLM"
+BLOOMHEADER = struct.Struct("<4sLQL")
+HASHSIZES = (20, 32)
+
+def addresshash(addr):
+    """ decode a base58 or bech32 address to its hash, returns None for other strings """
+    kind = BitcoinAddress.classify(addr)
+    if kind == "base58":
+        return Address.frombase58(addr).hash
+    if kind == "bech32":
+        return Address.frombech32(addr).hash
+
+
+def _bloomindexes(h, nbits, nhashes):
+    """ the hashes are uniformly distributed, so the bit indexes are derived directly from the hash bytes """
+    h1, h2 = struct.unpack_from("<QQ", h)
+    h2 |= 1
+    return [ (h1 + i*h2) % nbits for i in range(nhashes) ]
+
+class BloomFilter:
+    def __init__(self, filename):
+        self.fh = open(filename, "rb")
+        self.mm = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.nbits, self.nhashes = BLOOMHEADER.unpack_from(self.mm, 0)
+        if magic != BLOOMMAGIC or version != 1:
+            raise Exception("not a bloom filter file")
+
+    def __contains__(self, h):
+        mm = self.mm
+        for i in _bloomindexes(h, self.nbits, self.nhashes):
+            if not mm[BLOOMHEADER.size + (i>>3)] & (1 << (i&7)):
+                return False
+        return True
+
+    def close(self):
+        self.mm.close()
+        self.fh.close()
+
+    @staticmethod
+    def write(filename, hashes, count, bitsperentry):
+        """ write a filter for the 'count' hashes from the 'hashes' iterator """
+        nbits = max(count * bitsperentry, 64)
+        nhashes = max(1, int(round(bitsperentry * math.log(2))))
+        bits = bytearray((nbits+7)//8)
+        for h in hashes:
+            for i in _bloomindexes(h, nbits, nhashes):
+                bits[i>>3] |= 1 << (i&7)
+        with open(filename, "wb") as fh:
+            fh.write(BLOOMHEADER.pack(BLOOMMAGIC, 1, nbits, nhashes))
+            fh.write(bits)
+
+
+class HashFile:
+    """ a sorted file of fixed size hashes """
+    def __init__(self, filename, hashsize):
+        self.fh = open(filename, "rb")
+        magic, version, self.hashsize, self.nrecords = HEADER.unpack(self.fh.read(HEADER.size))
+        if magic != MAGIC or version != 1 or self.hashsize != hashsize:
+            raise Exception("not a %d byte address index file" % hashsize)
+        self.mm = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ) if self.nrecords else None
+
+    def __len__(self):
+        return self.nrecords
+
+    def __contains__(self, h):
+        mm = self.mm
+        size = self.hashsize
+        lo, hi = 0, self.nrecords
+        while lo < hi:
+            mid = (lo+hi)//2
+            o = HEADER.size + mid*size
+            key = mm[o:o+size]
+            if key < h:
+                lo = mid+1
+            elif key > h:
+                hi = mid
+            else:
+                return True
+        return False
+
+    def records(self):
+        size = self.hashsize
+        for i in range(self.nrecords):
+            o = HEADER.size + i*size
+            yield self.mm[o:o+size]
+
+    def close(self):
+        if self.mm:
+            self.mm.close()
+        self.fh.close()
+
+
+class AddrIndex:
+    """
+    Check if an address, or address hash is in the indexed list.
+    """
+    def __init__(self, name):
+        self.files = dict()
+        self.blooms = dict()
+        for size in HASHSIZES:
+            filename = "%s.%d" % (name, size)
+            if os.path.exists(filename):
+                self.files[size] = HashFile(filename, size)
+                if os.path.exists(filename + ".bloom"):
+                    self.blooms[size] = BloomFilter(filename + ".bloom")
+
+    def __len__(self):
+        return sum(len(f) for f in self.files.values())
+
+    def __contains__(self, h):
+        """ check for a 20 or 32 byte hash """
+        f = self.files.get(len(h))
+        if not f or not f.nrecords:
+            return False
+        bloom = self.blooms.get(len(h))
+        if bloom and h not in bloom:
+            return False
+        return h in f
+
+    def containsaddress(self, addr):
+        h = addresshash(addr)
+        return h is not None and h in self
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        for b in self.blooms.values():
+            b.close()
+
+    @staticmethod
+    def build(name, addresses, bitsperentry=10, runsize=1<<20, verbose=False):
+        """
+        build the index files for 'name' from an iterator of address strings.
+        Returns ( number of unique hashes, number of strings which could not be decoded ).
+        """
+        runs = dict((size, []) for size in HASHSIZES)
+        batches = dict((size, []) for size in HASHSIZES)
+        invalid = 0
+
+        def saverun(size):
+            batch = batches[size]
+            batch.sort()
+            fh = tempfile.TemporaryFile()
+            fh.write(b"".join(batch))
+            runs[size].append(fh)
+            batches[size] = []
+
+        for addr in addresses:
+            addr = addr.strip()
+            if not addr:
+                continue
+            try:
+                h = addresshash(addr)
+            except Exception:
+                h = None
+            if h is None or len(h) not in batches:
+                invalid += 1
+                continue
+            batch = batches[len(h)]
+            batch.append(h)
+            if len(batch) >= runsize:
+                saverun(len(h))
+
+        total = 0
+        for size in HASHSIZES:
+            batches[size].sort()
+            sources = [ readrecords(fh, size) for fh in runs[size] ] + [ batches[size] ]
+            filename = "%s.%d" % (name, size)
+            count = writehashes(filename, size, heapq.merge(*sources))
+            for fh in runs[size]:
+                fh.close()
+            batches[size] = []
+
+            hf = HashFile(filename, size)
+            BloomFilter.write(filename + ".bloom", hf.records(), count, bitsperentry)
+            hf.close()
+            if verbose:
+                print("%d hashes of %d bytes" % (count, size))
+            total += count
+
+        return total, invalid
+
+
+def readrecords(fh, size, chunk=0x10000):
+    """ iterate over the fixed size records in a run file """
+    fh.seek(0)
+    while True:
+        data = fh.read(size*chunk)
+        if not data:
+            break
+        for i in range(0, len(data), size):
+            yield data[i:i+size]
+
+def writehashes(filename, size, hashes):
+    """ write the sorted hashes, skipping duplicates, returns the number written """
+    tmpname = filename + ".tmp"
+    count = 0
+    last = None
+    with open(tmpname, "wb") as fh:
+        fh.write(HEADER.pack(MAGIC, 1, size, 0))
+        for h in hashes:
+            if h != last:
+                fh.write(h)
+                count += 1
+                last = h
+        fh.seek(0)
+        fh.write(HEADER.pack(MAGIC, 1, size, count))
+    os.replace(tmpname, filename)
+    return count
+
+
+def main():
+    import argparse
+    import sys
+    from binascii import a2b_hex
+    parser = argparse.ArgumentParser(description='build or query an address index')
+    parser.add_argument('--index', type=str, required=True, help='the base name of the index files')
+    parser.add_argument('--build', type=str, help='file with addresses to index, - for stdin')
+    parser.add_argument('--bits', type=int, default=10, help='bloom filter bits per address')
+    parser.add_argument('--runsize', type=int, default=1<<20, help='number of hashes sorted in memory')
+    parser.add_argument('--verbose', '-v', action='store_true')
+    parser.add_argument('ARGS', nargs='*', type=str, help='addresses or hex hashes to lookup, - for stdin')
+    args = parser.parse_args()
+
+    if args.build:
+        fh = sys.stdin if args.build == "-" else open(args.build)
+        total, invalid = AddrIndex.build(args.index, fh, args.bits, args.runsize, args.verbose)
+        print("indexed %d hashes, %d invalid addresses" % (total, invalid))
+
+    idx = AddrIndex(args.index)
+    queries = sys.stdin if args.ARGS == ["-"] else args.ARGS
+    for q in queries:
+        q = q.strip()
+        if not q:
+            continue
+        if BitcoinAddress.classify(q) in ("hash", "privkey"):
+            # a hex hash, 64 hex digits classifies as privkey.
+            found = a2b_hex(q) in idx
+        else:
+            try:
+                found = idx.containsaddress(q)
+            except Exception:
+                found = False
+        print("%s %s" % (q, "found" if found else "not found"))
+
+if __name__ == '__main__':
+    main()
@@ -1,73 +1,145 @@
 from __future__ import print_function, division
-from binascii import a2b_hex, b2a_hex
+from functools import lru_cache
+from operator import mul
 import struct
 from hashing import shasha
 """
 By Willem Hengeveld <itsme@xs4all.nl>
 
 base58 encode and decode
+
+The big number is converted in steps of 10 base58 digits, a value below 58**10
+fits in a machine word, and is converted using a table of all digit pairs.
 """
 
 charset= "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
 
+CHUNK = 10
+CHUNKBASE = 58**CHUNK
+
+# all two digit strings, indexed by their value
+_pairs = [ a+b for a in charset for b in charset ]
+
+# maps base58 characters to their digit value, other characters to 0xff
+_decodetable = bytes(charset.find(chr(i)) & 0xff for i in range(256))
+
+# the weights of the digits in a chunk
+_weights = tuple(58**i for i in range(CHUNK-1, -1, -1))
+
+def _chunkdigits(v):
+    """ the 10 digit string for a value below 58**10 """
+    v, d4 = divmod(v, 3364)
+    v, d3 = divmod(v, 3364)
+    v, d2 = divmod(v, 3364)
+    d0, d1 = divmod(v, 3364)
+    return _pairs[d0] + _pairs[d1] + _pairs[d2] + _pairs[d3] + _pairs[d4]
+
+def _encodeint(num):
+    chunks = []
+    while num >= CHUNKBASE:
+        num, r = divmod(num, CHUNKBASE)
+        chunks.append(_chunkdigits(r))
+    if num:
+        chunks.append(_chunkdigits(num).lstrip(charset[0]))
+    return "".join(chunks[::-1])
+
+def _decodedigits(digits):
+    """ convert a bytes object with digit values to a number """
+    num = 0
+    if len(digits) < 4*CHUNK:
+        # for address sized strings, a plain loop has the least overhead
+        for d in digits:
+            num = num * 58 + d
+        return num
+    n = len(digits)
+    first = n % CHUNK
+    if first:
+        num = sum(map(mul, digits[:first], _weights[-first:]))
+    for i in range(first, n, CHUNK):
+        num = num * CHUNKBASE + sum(map(mul, digits[i:i+CHUNK], _weights))
+    return num
+
 def encode(*args):
     """
     encode a value as base58.
     optionally takes a tag as it's first argument.
     """
-    def nbytes(x):
-       return (x.bit_length()+7)//8
-
     if len(args)==1:
         data = args[0]
     elif len(args)==2:
         data = struct.pack("<B", args[0]) + args[1]
         data += shasha(data)[0:4]
 
-    res= ""
     if type(data)==bytes:
-        bytelen= len(data)
-        if bytelen:
-            data= int(b2a_hex(data), 16)
-        else:
-            data= 0
-        nrzeros= bytelen - nbytes(data)
-    else:
-        data= int(data)
-        bytelen= nbytes(data)
-        nrzeros= 0
+        nrzeros= len(data) - len(data.lstrip(b"\x00"))
+        return charset[0] * nrzeros + _encodeint(int.from_bytes(data, "big"))
 
-    while data:
-        res += charset[data%58]
-        data //= 58
-
-    res += charset[0] * nrzeros
-    return res[::-1]
+    return _encodeint(int(data))
 
 
 def decode(enc):
-    num= 0
-    nrzeros= 0
-    for c in enc:
-        if c==charset[0]:
-            nrzeros += 1
-        else:
-            break
-
-    for c in enc:
-        digit= charset.find(c)
-        if digit<0:
-            break
-        num *= 58
-        num += digit
+    """
+    decode a base58 string to bytes.
+    decoding stops at the first invalid character.
+    """
+    digits = enc.encode('ascii', 'replace').translate(_decodetable)
+    end = digits.find(0xff)
+    if end >= 0:
+        digits = digits[:end]
 
-    if num:
-        hexstr= "%x" % num
-        if len(hexstr)%2:
-            hexstr= "0" + hexstr
-    else:
-        hexstr= ""
-    hexstr= "00" * nrzeros + hexstr
+    nrzeros = len(digits) - len(digits.lstrip(b"\x00"))
+    num = _decodedigits(digits)
+
+    return b"\x00" * nrzeros + num.to_bytes((num.bit_length()+7)//8, "big")
 
-    return a2b_hex(hexstr)
 
+def encode_many(items, tag=None):
+    """
+    encode a list of values, when a tag is passed a checksum is added, like with encode(tag, data)
+    """
+    if tag is None:
+        return [ encode(data) for data in items ]
+    return [ encode(tag, data) for data in items ]
+
+def decode_many(items):
+    """ decode a list of base58 strings """
+    return [ decode(enc) for enc in items ]
+
+
+def _checkdecode(enc):
+    """ strict decoding of a base58 string with a 4 byte checksum, returns ( version, payload ) """
+    digits = enc.encode('ascii', 'replace').translate(_decodetable)
+    if digits.find(0xff) >= 0:
+        raise Exception("Invalid base58 character")
+
+    nrzeros = len(digits) - len(digits.lstrip(b"\x00"))
+    num = _decodedigits(digits)
+    data = b"\x00" * nrzeros + num.to_bytes((num.bit_length()+7)//8, "big")
+    if len(data) < 5:
+        raise Exception("Invalid base58 length")
+    if shasha(data[:-4])[:4] != data[-4:]:
+        raise Exception("Invalid base58 checksum")
+    return data[0], data[1:-4]
+
+_cacheddecode = None
+
+def setcachesize(maxsize):
+    """
+    enable a LRU cache of at most 'maxsize' decoded strings for base58check_decode,
+    0 disables the cache.
+    """
+    global _cacheddecode
+    _cacheddecode = lru_cache(maxsize)(_checkdecode) if maxsize else None
+
+def base58check_decode(enc, expected_lengths=None):
+    """
+    decode a base58 string with a version byte and a 4 byte checksum,
+    like addresses and wallet keys.
+
+    Returns ( version, payload ). Raises an exception for invalid characters,
+    a wrong checksum, or when the payload length is not in 'expected_lengths'.
+    """
+    version, payload = (_cacheddecode or _checkdecode)(enc)
+    if expected_lengths and len(payload) not in expected_lengths:
+        raise Exception("Invalid base58 length")
+    return version, payload
@@ -1,5 +1,6 @@
 from __future__ import print_function, division
 import argparse
+import sys
 import coininfo
 import BitcoinAddress as bca
 """
@@ -7,73 +8,218 @@ By Willem Hengeveld <itsme@xs4all.nl>
 
 Tool for converting bitcoin addresses
 often bcaddr will auto detect the type of input data, and convert accordingly.
+
+Bulk mode: with --output, only the requested fields are printed, one csv or json line per input.
+Inputs are read from the commandline, or with --input from files or stdin.
+Conversion errors are printed to stderr, unless the 'error' field is selected.
+
+    python3 bcaddr.py --input addrs.txt --output input,hash,bech32 --format jsonl --workers 8
 """
 
 bca.setversions(0, 128)
 
+def hexfield(data):
+    return data.hex() if data is not None else None
+
+# the fields which can be selected with --output
+FIELDS = {
+    "type":        lambda a: None,   # filled in by convert
+    "hash":        lambda a: hexfield(a.compaddr and a.compaddr.hash),
+    "fullhash":    lambda a: hexfield(a.fulladdr and a.fulladdr.hash),
+    "address":     lambda a: a.compaddr and a.compaddr.base58(),
+    "fulladdress": lambda a: a.fulladdr and a.fulladdr.base58(),
+    "p2sh":        lambda a: a.p2sh and a.p2sh.base58(),
+    "p2shfull":    lambda a: a.p2shfull and a.p2shfull.base58(),
+    "bech32":      lambda a: a.bech32,
+    "p2wsh":       lambda a: a.p2wsh and a.p2wsh.bech32(),
+    "pubkey":      lambda a: hexfield(a.pubkey and a.pubkey.compressed()),
+    "fullpubkey":  lambda a: hexfield(a.pubkey and a.pubkey.uncompressed()),
+    "privkey":     lambda a: "%064x" % a.privkey.privkey if a.privkey else None,
+    "wallet":      lambda a: a.privkey and a.privkey.wallet(),
+    "cwallet":     lambda a: a.privkey and a.privkey.compwallet(),
+}
+
+def convert(line, decoder, fields):
+    """ returns a dict with the requested fields for one input line """
+    a = line.strip().replace(" ", "")
+    row = dict(input=a)
+    try:
+        if decoder:
+            kind = decoder
+        else:
+            kind = bca.BitcoinAddress.classify(a)
+            if not kind:
+                raise Exception("unknown string")
+        addr = getattr(bca.BitcoinAddress, "from_" + kind)(a)
+        for f in fields:
+            if f == "type":
+                row[f] = kind
+            elif f in FIELDS:
+                row[f] = FIELDS[f](addr)
+    except Exception as e:
+        row["error"] = str(e)
+    return row
+
+def formatrows(rows, fields, fmt):
+    if fmt == "jsonl":
+        import json
+        return "".join(json.dumps(dict((f, row.get(f)) for f in fields)) + "\n" for row in rows)
+    import csv
+    from io import StringIO
+    out = StringIO()
+    w = csv.writer(out, lineterminator="\n")
+    for row in rows:
+        w.writerow([ "" if row.get(f) is None else row[f] for f in fields ])
+    return out.getvalue()
+
+
+# the worker processes get their settings from the initializer
+
+_worker = None
+
+def initworker(aver, wver, secp256r1, decoder, fields, fmt):
+    global _worker
+    bca.setversions(aver, wver)
+    if secp256r1:
+        bca.B = bca.myecdsa.secp256r1()
+    _worker = decoder, fields, fmt
+
+def convertchunk(lines):
+    """ returns the formatted rows, and the errors which are not in the output """
+    decoder, fields, fmt = _worker
+    rows = [ convert(line, decoder, fields) for line in lines ]
+    errors = []
+    if "error" not in fields:
+        errors = [ "%s: %s" % (row["input"], row["error"]) for row in rows if "error" in row ]
+    return formatrows(rows, fields, fmt), errors
+
+def writechunk(result):
+    text, errors = result
+    sys.stdout.write(text)
+    for e in errors:
+        print(e, file=sys.stderr)
+
+def chunked(lines, size):
+    chunk = []
+    for line in lines:
+        if not line.strip():
+            continue
+        chunk.append(line)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def readinputs(names):
+    for name in names:
+        if name == "-":
+            for line in sys.stdin:
+                yield line
+        else:
+            with open(name) as fh:
+                for line in fh:
+                    yield line
+
+def bulkconvert(lines, args, decoder, fields):
+    """ convert all lines, writing the output in input order """
+    settings = (bca.address_version, bca.wallet_version, args.secp256r1, decoder, fields, args.format)
+    if args.format == "csv" and args.header:
+        sys.stdout.write(formatrows([ dict((f, f) for f in fields) ], fields, "csv"))
+    chunks = chunked(lines, args.chunksize)
+    if args.workers > 1:
+        import multiprocessing
+        with multiprocessing.Pool(args.workers, initializer=initworker, initargs=settings) as pool:
+            for result in pool.imap(convertchunk, chunks):
+                writechunk(result)
+    else:
+        initworker(*settings)
+        for chunk in chunks:
+            writechunk(convertchunk(chunk))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tool for converting between various representations of bitcoin addresses.')
+    parser.add_argument('-a', '--address_version',  type=str) # 0x6f for testnet, 0xc4 for testnet-p2sh
+    parser.add_argument('-w', '--wallet_version',  type=str)
+    parser.add_argument('--test', help='handle btc testnet addresses', action='store_true')
+    parser.add_argument('--lite', help='handle litecoin addresses', action='store_true')
+    parser.add_argument('--doge', help='handle dogecoin addresses', action='store_true')
+    parser.add_argument('--alt', type=str, help='Altcoin by name')
+    parser.add_argument('--privkey',  action='store_true')
+    parser.add_argument('--wallet',  action='store_true')
+    parser.add_argument('--minikey',  action='store_true')
+    parser.add_argument('--pubkey',  action='store_true')
+    parser.add_argument('--hash',  '--addrhash', action='store_true')
+    parser.add_argument('--address',  action='store_true')
+    parser.add_argument('--bech32',  action='store_true')
+    parser.add_argument('--script', action='store_true')
+    parser.add_argument('--secp256r1', action='store_true')
+    parser.add_argument('--output', type=str, help='comma separated list of fields to output: input,error,' + ",".join(FIELDS))
+    parser.add_argument('--format', type=str, choices=('csv', 'jsonl'), default='csv', help='output format for --output')
+    parser.add_argument('--header', action='store_true', help='print a csv header line')
+    parser.add_argument('--input', '-i', type=str, action='append', help='read inputs from file, - for stdin')
+    parser.add_argument('--workers', '-j', type=int, default=1, help='number of worker processes for bulk conversion')
+    parser.add_argument('--chunksize', type=int, default=1000, help='number of lines per worker job')
+    parser.add_argument('ARGS',  nargs='*', type=str)
+
+    args = parser.parse_args()
+    if args.secp256r1:
+        bca.B = bca.myecdsa.secp256r1()
+
+    if args.address_version is None:
+        args.address_version = 0
+    else:
+        args.address_version = int(args.address_version, 0)
+    if args.wallet_version is None:
+        args.wallet_version = 128
+    else:
+        args.wallet_version = int(args.wallet_version, 0)
+
+    if args.lite:
+        bca.setversions(48, 176)
+    elif args.doge:
+        bca.setversions(30, 128)
+    elif args.test:
+        bca.setversions(0, 0x6f)
+    elif args.alt:
+        coins= coininfo.by_name(args.alt)
+        if coins:
+            bca.setversions(coins[0].aver,coins[0].wver)
+            print("Using %s settings" % coins[0].names, file=sys.stderr if args.output else sys.stdout)
+    else:
+        bca.setversions(args.address_version, args.wallet_version)
+
+    decoder= None
+
+    if   args.privkey: decoder= "privkey"
+    elif args.wallet : decoder= "wallet"
+    elif args.minikey: decoder= "minikey"
+    elif args.pubkey : decoder= "pubkey"
+    elif args.hash   : decoder= "hash"
+    elif args.address: decoder= "base58"
+    elif args.bech32 : decoder= "bech32"
+    elif args.script : decoder= "script"
+
+    lines = args.ARGS
+    if args.input:
+        lines = readinputs(args.input)
+
+    if args.output:
+        fields = args.output.split(",")
+        unknown = [ f for f in fields if f not in FIELDS and f not in ("input", "error") ]
+        if unknown:
+            parser.error("unknown --output field: %s" % ",".join(unknown))
+        bulkconvert(lines, args, decoder, fields)
+        return
 
-parser = argparse.ArgumentParser(description='Tool for converting between various representations of bitcoin addresses.')
-parser.add_argument('-a', '--address_version',  type=str) # 0x6f for testnet, 0xc4 for testnet-p2sh
-parser.add_argument('-w', '--wallet_version',  type=str)
-parser.add_argument('--test', help='handle btc testnet addresses', action='store_true')
-parser.add_argument('--lite', help='handle litecoin addresses', action='store_true')
-parser.add_argument('--doge', help='handle dogecoin addresses', action='store_true')
-parser.add_argument('--alt', type=str, help='Altcoin by name')
-parser.add_argument('--privkey',  action='store_true')
-parser.add_argument('--wallet',  action='store_true')
-parser.add_argument('--minikey',  action='store_true')
-parser.add_argument('--pubkey',  action='store_true')
-parser.add_argument('--hash',  '--addrhash', action='store_true')
-parser.add_argument('--address',  action='store_true')
-parser.add_argument('--bech32',  action='store_true')
-parser.add_argument('--script', action='store_true')
-parser.add_argument('--secp256r1', action='store_true')
-parser.add_argument('ARGS',  nargs='*', type=str)
-
-# todo: --output <spec>: output only specific item for each input line
-# todo: support data from stdin
-
-args = parser.parse_args()
-if args.secp256r1:
-    bca.B = bca.myecdsa.secp256r1()
-
-if args.address_version is None:
-    args.address_version = 0
-else:
-    args.address_version = int(args.address_version, 0)
-if args.wallet_version is None:
-    args.wallet_version = 128
-else:
-    args.wallet_version = int(args.wallet_version, 0)
-
-if args.lite:
-    bca.setversions(48, 176)
-elif args.doge:
-    bca.setversions(30, 128)
-elif args.test:
-    bca.setversions(0, 0x6f)
-elif args.alt:
-    coins= coininfo.by_name(args.alt)
-    if coins:
-        bca.setversions(coins[0].aver,coins[0].wver)
-        print("Using %s settings" % coins[0].names)
-else:
-    bca.setversions(args.address_version, args.wallet_version)
-
-decoder= bca.BitcoinAddress.from_auto
-
-if   args.privkey: decoder= bca.BitcoinAddress.from_privkey
-elif args.wallet : decoder= bca.BitcoinAddress.from_wallet 
-elif args.minikey: decoder= bca.BitcoinAddress.from_minikey
-elif args.pubkey : decoder= bca.BitcoinAddress.from_pubkey
-elif args.hash   : decoder= bca.BitcoinAddress.from_hash   
-elif args.address: decoder= bca.BitcoinAddress.from_base58
-elif args.bech32 : decoder= bca.BitcoinAddress.from_bech32
-elif args.script : decoder= bca.BitcoinAddress.from_script
-
-for a in args.ARGS:
-    a = a.strip().replace(" ", "")
-    addr= decoder(a)
-    if addr:
-        addr.dump()
+    for a in lines:
+        a = a.strip().replace(" ", "")
+        if not a:
+            continue
+        addr= getattr(bca.BitcoinAddress, "from_" + (decoder or "auto"))(a)
+        if addr:
+            addr.dump()
 
+if __name__ == '__main__':
+    main()
@@ -50,6 +50,42 @@ class Reader:
         obj.decode(self)
         return obj
 
+class BufferReader(Reader):
+    """
+    Reader decoding directly from a buffer, like a mmap,
+    without first copying the data into a BytesIO.
+    """
+    def __init__(self, data, offset=0, end=None):
+        self.data = data
+        self.pos = offset
+        self.end = len(data) if end is None else end
+    def tell(self):
+        return self.pos
+    def readbyte(self):
+        pos = self.pos
+        if pos >= self.end:
+            return
+        self.pos = pos+1
+        return self.data[pos]
+    def readbytes(self, size):
+        pos = self.pos
+        if pos >= self.end:
+            return b""
+        if pos+size > self.end:
+            raise Exception("not enough data")
+        self.pos = pos+size
+        return self.data[pos:pos+size]
+
+def varintsize(x):
+    """ the number of bytes needed to encode x as a varint """
+    if x<0xfd:
+        return 1
+    if x<0x10000:
+        return 3
+    if x<0x100000000:
+        return 5
+    return 9
+
 class Writer:
     """ helper class for writing data from a transaction """
     def __init__(self, fh):
@@ -1,40 +1,95 @@
 from bcdataio import Reader, Writer
 from io import BytesIO
 
-from hashing import shasha, sharip
-from txndecoder import Script
+from hashing import shasha, sharip, sha256, sha256ctx, Midstate, tagmidstate
+from txndecoder import Script, Output, pushed_items
 from binascii import b2a_hex
+import struct
+
+SECP256K1_ORDER = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
+
+def _der_strict(sig):
+    """ return the ( r, s ) value slices, when 'sig' follows the bip66 rules, or None """
+    n = len(sig)
+    if n < 9 or n > 73: return
+    if sig[0] != 0x30 or sig[1] != n-3: return
+    rlen = sig[3]
+    if 5+rlen >= n: return
+    slen = sig[5+rlen]
+    if rlen+slen+7 != n: return
+    if sig[2] != 0x02 or rlen == 0 or sig[4]&0x80: return
+    if rlen > 1 and sig[4] == 0 and not sig[5]&0x80: return
+    if sig[rlen+4] != 0x02 or slen == 0 or sig[rlen+6]&0x80: return
+    if slen > 1 and sig[rlen+6] == 0 and not sig[rlen+7]&0x80: return
+    return sig[4:4+rlen], sig[6+rlen:6+rlen+slen], sig[n-1]
+
+def _der_lenient(sig):
+    """ return the ( r, s ) value slices, checking only the tags and bounds, or None """
+    n = len(sig)
+    if n < 8 or sig[0] != 0x30 or sig[2] != 0x02:
+        return
+    rlen = sig[3]
+    if 6+rlen > n or sig[4+rlen] != 0x02:
+        return
+    slen = sig[5+rlen]
+    end = 6+rlen+slen
+    if end > n:
+        return
+    # note: for BitcoinCash the hashtype has many different values, or is missing
+    hashtype = sig[end] if end < n else 0
+    return sig[4:4+rlen], sig[6+rlen:end], hashtype or 1
+
+def decode_der(sig, strict=True, lows=False):
+    """
+    Decode a DER encoded signature, followed by the hashtype byte.
+    returns integers: ( r, s, hashtype ).
+
+    With 'strict', the bip66 encoding rules are enforced,
+    otherwise only the tags and lengths are checked.
+    With 'lows', s is normalized to the lower half of the group order.
+    """
+    parts = _der_strict(sig) if strict else _der_lenient(sig)
+    if parts is None:
+        raise Exception("not a valid signature")
+    rval, sval, hashtype = parts
+    r = int.from_bytes(rval, "big")
+    s = int.from_bytes(sval, "big")
+    if r >> 256 or s >> 256:
+        raise Exception("signature value too large")
+    if lows and s > SECP256K1_ORDER//2:
+        s = SECP256K1_ORDER - s
+    return r, s, hashtype
+
+def decode_signatures_bulk(sigs, strict=True, lows=False):
+    """
+    Decode a list of signatures, returns a list of ( r, s, hashtype ) tuples,
+    with None for invalid signatures.
+    """
+    parse = _der_strict if strict else _der_lenient
+    frombytes = int.from_bytes
+    half = SECP256K1_ORDER//2
+    res = []
+    for sig in sigs:
+        parts = parse(sig)
+        if parts is None:
+            res.append(None)
+            continue
+        r = frombytes(parts[0], "big")
+        s = frombytes(parts[1], "big")
+        if r >> 256 or s >> 256:
+            res.append(None)
+            continue
+        if lows and s > half:
+            s = SECP256K1_ORDER - s
+        res.append((r, s, parts[2]))
+    return res
 
 def decode_signature(sigdata):
-    """ extract the r and s values from a signature """
+    """ extract the r and s values from a signature, as 32 byte strings """
     if len(sigdata)==0x41:
         return sigdata[0:32], sigdata[32:64], sigdata[64]
-    r = Reader(BytesIO(sigdata))
-
-    seqtag = r.readbyte()
-    if seqtag != 0x30:
-        raise Exception("not a signature")
-    rslen = r.readbyte()
-    inttag = r.readbyte()
-    if inttag != 0x02: raise Exception("not a signature")
-    rlen = r.readbyte()
-    rval = r.readbytes(rlen)
-    inttag = r.readbyte()
-    if inttag != 0x02: raise Exception("not a signature")
-    slen = r.readbyte()
-    sval = r.readbytes(slen)
-
-    # note: for BitcoinCash this has many different values, or None
-    sighashtype = r.readbyte() or 1  # 1,2,3 or 0x81,0x82,0x83
-
-    def make32bytes(x):
-        if len(x)==32:
-            return x
-        if len(x)<32:
-            return x.rjust(32, b"\x00")
-        return x[-32:]
-
-    return make32bytes(rval), make32bytes(sval), sighashtype 
+    r, s, sighashtype = decode_der(sigdata, strict=False)
+    return r.to_bytes(32, "big"), s.to_bytes(32, "big"), sighashtype
 
 def messagehash(txn, hashtype, inputindex, outscript):
     """ Calculate the message hash given the transaction, crackinfo and inputindex """
@@ -62,10 +117,11 @@ def messagehash(txn, hashtype, inputindex, outscript):
         txndup.outputs = []
     elif _single:
         txndup.outputs = txndup.outputs[:inputindex+1]
-        for i, out in enumerate(txndup.outputs):
-            if i!=inputindex:
-                out.script = Script()
-                out.btcvalue = 2**64-1
+        for i in range(inputindex):
+            blank = Output()
+            blank.script = Script()
+            blank.btcvalue = 2**64-1
+            txndup.outputs[i] = blank
 
     bio = BytesIO()
     w = Writer(bio) 
@@ -79,6 +135,98 @@ def messagehash(txn, hashtype, inputindex, outscript):
     return shasha(data)
 
 
+def _encode(obj):
+    """ return the serialized form of a transaction component """
+    bio = BytesIO()
+    obj.encode(Writer(bio))
+    return bio.getvalue()
+
+def _varint(x):
+    bio = BytesIO()
+    Writer(bio).writevarint(x)
+    return bio.getvalue()
+
+class LegacySighash:
+    """
+    Calculate pre-segwit message hashes for the inputs of one transaction.
+
+    The transaction is serialized only once, into segments: the version,
+    each input with an empty script, the outputs and the locktime.
+    The preimage for an input is then streamed from these segments into a sha256
+    context. The hash state after the inputs preceding the signed input is kept,
+    so hashing the inputs in order does not rehash that prefix.
+
+    This gives the same results as `messagehash`.
+    """
+    INPUTSIZE = 41    # outpoint, empty script, sequence
+
+    def __init__(self, txn):
+        self.txn = txn
+        self.header = struct.pack("<L", txn.version) + _varint(len(txn.inputs))
+        self.outpoints = [ inp.txn_hash + struct.pack("<L", inp.output_index) for inp in txn.inputs ]
+        self.sequences = [ struct.pack("<L", inp.sequence_number) for inp in txn.inputs ]
+
+        # the inputs with empty scripts, with and without sequence numbers
+        self.emptyinputs = memoryview(b"".join(op + b"\x00" + seq for op, seq in zip(self.outpoints, self.sequences)))
+        self.zeroseqinputs = memoryview(b"".join(op + b"\x00" + b"\x00"*4 for op in self.outpoints))
+
+        self.outputs = [ _encode(out) for out in txn.outputs ]
+        self.alloutputs = _varint(len(self.outputs)) + b"".join(self.outputs)
+        self.locktime = struct.pack("<L", txn.locktime)
+
+        # per input-blob: ( nr of inputs hashed, sha256 context )
+        self._cursor = dict()
+
+    def _prefix(self, zeroseq, inputindex):
+        """ return a hash context containing the header, and the inputs before 'inputindex' """
+        inputs = self.zeroseqinputs if zeroseq else self.emptyinputs
+        n, h = self._cursor.get(zeroseq, (None, None))
+        if n is None or n > inputindex:
+            n, h = 0, sha256ctx(self.header)
+        if n < inputindex:
+            h.update(inputs[n*self.INPUTSIZE:inputindex*self.INPUTSIZE])
+            n = inputindex
+        self._cursor[zeroseq] = (n, h)
+        return h.copy()
+
+    def _singleoutputs(self, inputindex):
+        return _varint(inputindex+1) + (b"\xff"*8 + b"\x00") * inputindex + self.outputs[inputindex]
+
+    def messagehash(self, inputindex, hashtype, outscript):
+        """ Calculate the message hash for input 'inputindex', spending 'outscript' """
+        _anyonecanpay = hashtype&0x80
+        _single = (hashtype&31) == 3
+        _none = (hashtype&31) == 2
+
+        if _single and inputindex >= len(self.outputs):
+            # this is a documented bug!!
+            return b"\x01" + b"\x00"*31
+
+        signedinput = self.outpoints[inputindex] + _encode(outscript) + self.sequences[inputindex]
+
+        if _none:
+            outputs = b"\x00"
+        elif _single:
+            outputs = self._singleoutputs(inputindex)
+        else:
+            outputs = self.alloutputs
+
+        if _anyonecanpay:
+            h = sha256ctx(self.header[:4], b"\x01", signedinput)
+        else:
+            zeroseq = bool(_single or _none)
+            h = self._prefix(zeroseq, inputindex)
+            h.update(signedinput)
+            inputs = self.zeroseqinputs if zeroseq else self.emptyinputs
+            h.update(inputs[(inputindex+1)*self.INPUTSIZE:])
+
+        h.update(outputs)
+        h.update(self.locktime)
+        h.update(struct.pack("<L", hashtype))
+
+        return sha256(h.digest())
+
+
 def calcPrevOutsHash(txn):
     bio = BytesIO()
     w = Writer(bio) 
@@ -116,53 +264,233 @@ def calcSingleHash(txn, inputindex):
     else:
         return b"\x00"*32
 
-def witnesshash(txn, hashtype, inputindex, btcvalue, outscript):
-    _anyonecanpay = hashtype&0x80
-    _single = (hashtype&31) == 3
-    _none = (hashtype&31) == 2
+class SighashCache:
+    """
+    Calculate segwit ( bip143 ) and taproot ( bip341 ) message hashes for the inputs of one transaction.
+
+    The hashes over all prevouts, sequences and outputs are the same for all
+    inputs, so they are calculated only once. The bip143 values are the double sha256
+    of the serialized data, the bip341 values the single sha256, so the bip143 hashes
+    are derived from the bip341 hashes. The per output hashes
+    for SIGHASH_SINGLE are calculated on demand.
+
+    Taproot hashes commit to all spent outputs, these are passed as a list of
+    `Output` objects in 'prevouts'.
+    """
+    def __init__(self, txn, prevouts=None):
+        self.txn = txn
+        self.prevouts = prevouts
+        self._sha = dict()
+        self._singlehash = dict()
+
+    def _cached(self, name, calc):
+        h = self._sha.get(name)
+        if h is None:
+            h = self._sha[name] = calc()
+        return h
+
+    def sha_prevouts(self):
+        return self._cached("prevouts", lambda: sha256(b"".join(inp.txn_hash + struct.pack("<L", inp.output_index) for inp in self.txn.inputs)))
+
+    def sha_sequences(self):
+        return self._cached("sequences", lambda: sha256(b"".join(struct.pack("<L", inp.sequence_number) for inp in self.txn.inputs)))
+
+    def sha_outputs(self):
+        return self._cached("outputs", lambda: sha256(b"".join(_encode(out) for out in self.txn.outputs)))
+
+    def sha_amounts(self):
+        return self._cached("amounts", lambda: sha256(b"".join(struct.pack("<Q", out.btcvalue) for out in self.spentoutputs())))
+
+    def sha_scriptpubkeys(self):
+        return self._cached("scriptpubkeys", lambda: sha256(b"".join(_encode(out.script) for out in self.spentoutputs())))
+
+    def sha_single_output(self, inputindex):
+        h = self._singlehash.get(inputindex)
+        if h is None:
+            h = self._singlehash[inputindex] = sha256(_encode(self.txn.outputs[inputindex]))
+        return h
+
+    def spentoutputs(self):
+        if self.prevouts is None or len(self.prevouts) != len(self.txn.inputs):
+            raise Exception("taproot sighash needs all spent outputs")
+        return self.prevouts
+
+    def prevoutshash(self):
+        return self._cached("hashPrevouts", lambda: sha256(self.sha_prevouts()))
+
+    def sequencehash(self):
+        return self._cached("hashSequence", lambda: sha256(self.sha_sequences()))
+
+    def outputshash(self):
+        return self._cached("hashOutputs", lambda: sha256(self.sha_outputs()))
+
+    def singlehash(self, inputindex):
+        if inputindex >= len(self.txn.outputs):
+            return b"\x00"*32
+        return sha256(self.sha_single_output(inputindex))
+
+    def witnesshash(self, inputindex, hashtype, btcvalue, scriptcode=None, scriptpubkey=None):
+        """
+        Calculate the message hash for input 'inputindex', spending an output of 'btcvalue'.
+
+        When no scriptcode is passed, it is derived from the input's witness,
+        using the witness program 'scriptpubkey' to decide between p2wpkh and p2wsh.
+        By default that is taken from the prevouts, when these were passed.
+        """
+        txn = self.txn
+        _anyonecanpay = hashtype&0x80
+        _single = (hashtype&31) == 3
+        _none = (hashtype&31) == 2
+
+        prefix = self._bip143prefix(_anyonecanpay, _anyonecanpay or _single or _none)
 
-    bio = BytesIO()
-    w = Writer(bio) 
-    w.writedword(txn.version)             # nVersion
-
-    if _anyonecanpay:
-        w.writebytes(b"\x00"*32)
-    else:
-        w.writebytes(calcPrevOutsHash(txn))   # hashPrevouts
-
-    if _anyonecanpay or _single or _none:
-        w.writebytes(b"\x00"*32)
-    else:
-        w.writebytes(calcSequenceHash(txn))   # hashSequence
-
-    inp = txn.inputs[inputindex]
-    w.writebytes(inp.txn_hash)            # outpoint.hash
-    w.writedword(inp.output_index)        # outpoint.index
-
-    if txn.witness:
-        wit = txn.witness[inputindex]
-        if not wit.encode_scriptcode(w):      # scriptcode
-            return messagehash(txn, hashtype, inputindex, outscript)
-    else:
-        outscript.encode(w)
+        bio = BytesIO()
+        w = Writer(bio) 
+        inp = txn.inputs[inputindex]
+        w.writebytes(inp.txn_hash)            # outpoint.hash
+        w.writedword(inp.output_index)        # outpoint.index
+
+        if scriptcode is not None:
+            scriptcode.encode(w)              # scriptcode
+        elif txn.witness:
+            if scriptpubkey is None:
+                scriptpubkey = self.witnessprogram(inputindex)
+            txn.witness[inputindex].encode_scriptcode(w, scriptpubkey)
+        else:
+            raise Exception("no scriptcode for non-witness transaction")
 
-    w.writeqword(btcvalue)                # value
-    w.writedword(inp.sequence_number)     # nSequence
+        w.writeqword(btcvalue)                # value
+        w.writedword(inp.sequence_number)     # nSequence
 
-    if _single:
-        if inputindex < len(txn.outputs):
-            w.writebytes(calcSingleHash(txn, inputindex))
-        else:
+        if _single:
+            w.writebytes(self.singlehash(inputindex))
+        elif _none:
             w.writebytes(b"\x00"*32)
-    elif _none:
-        w.writebytes(b"\x00"*32)
-    else:
-        w.writebytes(calcOutputsHash(txn))    # hashOutputs
+        else:
+            w.writebytes(self.outputshash())    # hashOutputs
+
+        w.writedword(txn.locktime)            # nLocktime
+        w.writedword(hashtype)                # hashtype
+
+        return prefix.shasha(bio.getvalue())
+
+    def _bip143prefix(self, noprevouts, nosequences):
+        """
+        The Midstate after nVersion, hashPrevouts and hashSequence, these
+        68 bytes are the same for all inputs signed with similar hashtypes.
+        """
+        def calc():
+            return Midstate(struct.pack("<L", self.txn.version),
+                    b"\x00"*32 if noprevouts else self.prevoutshash(),
+                    b"\x00"*32 if nosequences else self.sequencehash())
+        return self._cached(("bip143", bool(noprevouts), bool(nosequences)), calc)
+
+
+    def taproothash(self, inputindex, hashtype, leafhash=None, annex=None, codesep_pos=0xffffffff):
+        """
+        Calculate the bip341 message hash for input 'inputindex'.
+
+        For a key path spend, leave 'leafhash' None, for a script path spend
+        pass the tapleaf hash of the executed script.
+        'annex' is the annex, including the 0x50 tag.
+        """
+        txn = self.txn
+        if hashtype not in (0x00, 0x01, 0x02, 0x03, 0x81, 0x82, 0x83):
+            raise Exception("invalid taproot hashtype")
+        _anyonecanpay = hashtype&0x80
+        _outputtype = (hashtype&3) or 1
+        _single = _outputtype == 3
+        _none = _outputtype == 2
+
+        prefix = self._taprootprefix(hashtype)
 
-    w.writedword(txn.locktime)            # nLocktime
-    w.writedword(hashtype)                # hashtype
+        bio = BytesIO()
+        w = Writer(bio)
+        extflag = 0 if leafhash is None else 1
+        w.writebyte(extflag*2 + (annex is not None))   # spend_type
+
+        inp = txn.inputs[inputindex]
+        if _anyonecanpay:
+            spent = self.spentoutputs()[inputindex]
+            w.writebytes(inp.txn_hash)
+            w.writedword(inp.output_index)
+            w.writeqword(spent.btcvalue)
+            spent.script.encode(w)
+            w.writedword(inp.sequence_number)
+        else:
+            w.writedword(inputindex)
+
+        if annex is not None:
+            w.writebytes(sha256(_varint(len(annex)), annex))
+
+        if _single:
+            if inputindex >= len(txn.outputs):
+                raise Exception("SIGHASH_SINGLE without matching output")
+            w.writebytes(self.sha_single_output(inputindex))
+
+        if extflag:
+            w.writebytes(leafhash)
+            w.writebyte(0)                    # key_version
+            w.writedword(codesep_pos)
+
+        return prefix.sha256(bio.getvalue())
+
+    def _taprootprefix(self, hashtype):
+        """
+        The Midstate after the TapSighash tag and the transaction data, which
+        depend only on the hashtype.
+        """
+        def calc():
+            _anyonecanpay = hashtype&0x80
+            _outputtype = (hashtype&3) or 1
+            data = [ struct.pack("<BBLL", 0, hashtype, self.txn.version, self.txn.locktime) ]
+            if not _anyonecanpay:
+                data += [ self.sha_prevouts(), self.sha_amounts(), self.sha_scriptpubkeys(), self.sha_sequences() ]
+            if _outputtype == 1:
+                data.append(self.sha_outputs())
+            return tagmidstate("TapSighash").extend(*data)
+        return self._cached(("bip341", hashtype), calc)
+
+    def witnessprogram(self, inputindex):
+        """
+        the script with the witness program spent by input 'inputindex': the prevout's script,
+        or for a p2sh wrapped witness the redeemscript. None when the prevouts are not known.
+        """
+        if not self.prevouts:
+            return
+        spk = self.prevouts[inputindex].script
+        if spk.classify()[0] == "p2sh":
+            items = pushed_items(self.txn.inputs[inputindex].script.bytecode)
+            if items:
+                spk = Script()
+                spk.bytecode = items[-1]
+        return spk
+
+    def inputhash(self, inputindex, hashtype, btcvalue=None):
+        """
+        Calculate the message hash for a witness input, using the type of it's witness.
+        """
+        wit = self.txn.witness[inputindex]
+        spk = self.witnessprogram(inputindex)
+        t = wit.gettype(spk)
+        if t == "p2tr":
+            return self.taproothash(inputindex, hashtype, annex=wit.annex())
+        if t == "p2tr-script":
+            return self.taproothash(inputindex, hashtype, leafhash=wit.tapleafhash(), annex=wit.annex())
+        if btcvalue is None:
+            btcvalue = self.spentoutputs()[inputindex].btcvalue
+        return self.witnesshash(inputindex, hashtype, btcvalue, scriptpubkey=spk)
 
-    data = bio.getvalue()
-    return shasha(data)
 
+def witnesshash(txn, hashtype, inputindex, btcvalue, outscript):
+    """
+    Calculate the segwit message hash for a single input.
 
+    Use a SighashCache when hashing several inputs of the same transaction.
+    """
+    if txn.witness and txn.witness[inputindex].wstruct:
+        return SighashCache(txn).witnesshash(inputindex, hashtype, btcvalue, scriptpubkey=outscript)
+    if txn.witness:
+        # a non-witness input in a segwit transaction.
+        return messagehash(txn, hashtype, inputindex, outscript)
+    return SighashCache(txn).witnesshash(inputindex, hashtype, btcvalue, outscript)
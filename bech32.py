@@ -1,11 +1,49 @@
-""" module for decoding and encoding bech32 addresses """
-import re
+""" module for decoding and encoding bech32 addresses
+
+The checksum is calculated two characters at a time, using a table with the
+contribution of the top 10 bits of the checksum state.
+The checksum state after the human readable prefix is cached per prefix.
+"""
 
 alphabet = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
 
+# maps characters to their 5 bit value, other characters to 0xff
+_charmap = bytes(alphabet.find(chr(i)) & 0xff for i in range(256))
+# maps 5 bit values to characters
+_quintmap = alphabet.encode('ascii') + bytes(256-32)
+
 def binary(x, n):
     return bin(x)[2:].rjust(n, '0')
 
+def convertbits(data, frombits, tobits, pad=True):
+    """
+    regroup an iterable of 'frombits' sized values into 'tobits' sized values, returns bytes.
+    The values are processed one at a time, so 'data' can be a stream.
+    With 'pad' the last incomplete group is zero padded, otherwise the remaining
+    bits must be fewer than 'frombits' and zero, as in bip173.
+    """
+    acc = 0
+    bits = 0
+    maxv = (1 << tobits) - 1
+    mask = (1 << (frombits + tobits - 1)) - 1
+    res = bytearray()
+    for value in data:
+        if value >> frombits:
+            raise Exception("value too large for convertbits")
+        acc = ((acc << frombits) | value) & mask
+        bits += frombits
+        while bits >= tobits:
+            bits -= tobits
+            res.append((acc >> bits) & maxv)
+    if pad:
+        if bits:
+            res.append((acc << (tobits - bits)) & maxv)
+    elif bits >= frombits or (acc << (tobits - bits)) & maxv:
+        raise Exception("invalid padding in convertbits")
+    return bytes(res)
+
+# for the short data in addresses, converting via one int is faster than convertbits.
+
 def quintstobytes(quints):
     res = 0
     for b in quints:
@@ -13,26 +51,29 @@ def quintstobytes(quints):
         res += b
 
     n = (len(quints)*5)//8
-    #print("b=%3d, n=%3d -> shift=%d" % (len(quints)*5, n*8, len(quints)*5-n*8))
     res >>= len(quints)*5-n*8
     return res.to_bytes(n, "big")
 
 def bytestoquints(data):
-    val = int.from_bytes(data, "big")
     n = (len(data)*8+4)//5
+    val = int.from_bytes(data, "big") << (n*5-len(data)*8)
+    return [ (val >> s) & 31 for s in range(n*5-5, -1, -5) ]
+
+# maps bech32 characters to base 32 digits, for int(txt, 32)
+_todigits = str.maketrans(alphabet, "0123456789abcdefghijklmnopqrstuv")
 
-    val <<= n*5-len(data)*8
-    quints = []
-    for i in range(n):
-        quints.append(val&31)
-        val //= 32
-    return quints[::-1]
+def _texttobytes(txt):
+    """ convert validated bech32 characters to bytes, dropping the padding bits """
+    if not txt:
+        return b""
+    n = (len(txt)*5)//8
+    return (int(txt.translate(_todigits), 32) >> (len(txt)*5-n*8)).to_bytes(n, "big")
 
 def decode32toquints(txt):
-    return [ alphabet.find(c) for c in txt ]
+    return list(txt.encode('ascii', 'replace').translate(_charmap))
 
 def encode32(digits):
-    return "".join(alphabet[d] for d in digits)
+    return bytes(digits).translate(_quintmap).decode('ascii')
 
 
 def detaildecode(txt):
@@ -42,42 +83,75 @@ def detaildecode(txt):
 
 BECH32_CONST = 1
 BECH32M_CONST = 0x2bc830a3 # taproot addr: see bip350
-def bech32_polymod(values):
-    GEN = [0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3]
-    chk = 1
-    for v in values:
-        b = (chk >> 25)
-        chk = (chk & 0x1ffffff) << 5 ^ v
-        for i in range(5):
-            chk ^= GEN[i] if ((b >> i) & 1) else 0
+
+GEN = [0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3]
+
+def _genxor(b):
+    g = 0
+    for i in range(5):
+        if (b >> i) & 1:
+            g ^= GEN[i]
+    return g
+
+# the contribution of the top 5 bits of the state for one step
+_table1 = [ _genxor(b) for b in range(32) ]
+
+def _step1(chk, v):
+    return (chk & 0x1ffffff) << 5 ^ v ^ _table1[chk >> 25]
+
+# the contribution of the top 10 bits of the state for two steps
+_table2 = [ _step1(_step1(t << 20, 0), 0) for t in range(1024) ]
+
+def bech32_polymod(values, chk=1):
+    """ the bech32 checksum of 'values', continuing from state 'chk' """
+    n = len(values)
+    if n & 1:
+        chk = _step1(chk, values[0])
+    table = _table2
+    it = iter(values[n & 1:])
+    for a, b in zip(it, it):
+        chk = (chk & 0xfffff) << 10 ^ table[chk >> 20] ^ a << 5 ^ b
     return chk
 
 def bech32_hrp_expand(s):
     return [ord(x) >> 5 for x in s] + [0] + [ord(x) & 31 for x in s]
 
+_hrpstates = dict()
+
+def hrpstate(hrp):
+    """ the validated and cached checksum state after the human readable prefix """
+    chk = _hrpstates.get(hrp)
+    if chk is None:
+        if any(not 33 <= ord(c) <= 126 for c in hrp) or hrp.lower() != hrp:
+            raise Exception("invalid bech32 prefix")
+        chk = bech32_polymod(bech32_hrp_expand(hrp))
+        if len(_hrpstates) < 1024:
+            _hrpstates[hrp] = chk
+    return chk
+
 def bech32_calc_checksum(hrp, data):
-    return bech32_polymod(bech32_hrp_expand(hrp) + data)
+    return bech32_polymod(data, hrpstate(hrp))
 
 def bech32_create_checksum(hrp, data, taproot_flag):
-    values = bech32_hrp_expand(hrp) + data
-
-    polymod = bech32_polymod(values + [0,0,0,0,0,0])
+    polymod = bech32_polymod(data + [0,0,0,0,0,0], hrpstate(hrp))
     if taproot_flag:
         polymod ^= BECH32M_CONST
     else:
         polymod ^= BECH32_CONST
     return [(polymod >> 5 * (5 - i)) & 31 for i in range(6)]
 
-def decode(txt):
-    """
-    note: taproot signature is encoded in bit7 of the tag.
-    """
-    m = re.match(r'(?:(\w+)1)?(\w+)', txt)
-    if not m:
-        raise Exception("invalid bech32")
-    hrp = m.group(1) or ""
-    b32 = m.group(2)
-    chk = bech32_calc_checksum(hrp, decode32toquints(b32))
+def splithrp(txt):
+    """ split at the last '1' into: hrp, data part """
+    i = txt.rfind('1')
+    if i < 0:
+        return "", txt
+    return txt[:i], txt[i+1:]
+
+def _decode(hrp, b32, state):
+    quints = b32.encode('ascii', 'replace').translate(_charmap)
+    if len(quints) < 7 or quints.find(0xff) >= 0:
+        raise Exception("invalid bech32 character")
+    chk = bech32_polymod(quints, state)
 
     if chk == BECH32_CONST:
         sigflag = 0
@@ -86,16 +160,191 @@ def decode(txt):
     else:
         raise Exception("invalid bech32")
 
-    quints = decode32toquints(b32[:-6])
-
     tag = quints[0] | sigflag
-    data = quintstobytes(quints[1:])
+    data = _texttobytes(b32[1:-6])
     return hrp, tag, data
 
+def decode(txt):
+    """
+    note: taproot signature is encoded in bit7 of the tag.
+    """
+    hrp, b32 = splithrp(txt)
+    return _decode(hrp, b32, hrpstate(hrp))
+
 def encode(hrp, tag, data):
+    return _encode(hrp, tag, data, hrpstate(hrp))
+
+def _encode(hrp, tag, data, state):
     quints = [tag%32] + bytestoquints(data)
-    chk = bech32_create_checksum(hrp, quints, tag&0x80)
+    polymod = bech32_polymod(quints + [0,0,0,0,0,0], state)
+    polymod ^= BECH32M_CONST if tag&0x80 else BECH32_CONST
+    quints += [(polymod >> 5 * (5 - i)) & 31 for i in range(6)]
     if hrp:
         hrp += "1"
-    return hrp + encode32(quints) + encode32(chk)
+    return hrp + encode32(quints)
+
+def encode_many(hrp, items):
+    """ encode a list of ( tag, data ) pairs, all with the same prefix """
+    state = hrpstate(hrp)
+    return [ _encode(hrp, tag, data, state) for tag, data in items ]
+
+def decode_many(items, hrp=None):
+    """
+    decode a list of bech32 strings, returns a list of ( hrp, tag, data ).
+    When 'hrp' is given, all strings must have that prefix.
+    """
+    if hrp is None:
+        return [ decode(txt) for txt in items ]
+    state = hrpstate(hrp)
+    result = []
+    for txt in items:
+        h, b32 = splithrp(txt)
+        if h != hrp:
+            raise Exception("unexpected bech32 prefix")
+        result.append(_decode(hrp, b32, state))
+    return result
+
+
+# error location
+#
+# The checksum is linear over GF(32): an error 'e' in the character 'p' places before
+# the end of the data part changes the checksum by e times a value only depending on 'p'.
+# For strings up to 89 characters bech32 has a distance of 5, so the checksum
+# difference ( the syndrome ) identifies any one or two wrong characters.
+#
+# Scaling all error values by the same factor scales the syndrome, so the tables
+# are keyed by the syndrome normalized to have a leading digit of 1. This makes the
+# table of all two-error patterns 31 times smaller, and locating errors is one lookup.
+
+MAXDATALEN = 89
+
+def _gfmul(a, b):
+    """ multiply in GF(32), modulo x^5 + x^3 + 1 """
+    r = 0
+    while b:
+        if b & 1:
+            r ^= a
+        b >>= 1
+        a <<= 1
+        if a & 32:
+            a ^= 41
+    return r
+
+_gfmultable = [ [ _gfmul(a, b) for b in range(32) ] for a in range(32) ]
+_gfinverse = [0] + [ next(b for b in range(1, 32) if _gfmul(a, b) == 1) for a in range(1, 32) ]
+
+def _scale(x, c):
+    """ multiply each of the 6 digits of a checksum value by c """
+    m = _gfmultable[c]
+    return m[x & 31] | m[x >> 5 & 31] << 5 | m[x >> 10 & 31] << 10 | m[x >> 15 & 31] << 15 | m[x >> 20 & 31] << 20 | m[x >> 25] << 25
+
+def _normalize(x):
+    """ returns ( normalized syndrome, leading digit ) """
+    shift = 25
+    while not x >> shift:
+        shift -= 5
+    lead = x >> shift & 31
+    return _scale(x, _gfinverse[lead]), lead
+
+_errortables = None
+
+def _errorsyndromes():
+    """
+    returns two dicts, mapping normalized syndromes to the normalized errors:
+    ( p, e ) for single errors, and ( p1, e1, p2, e2 ) with p1 < p2 for two errors.
+    """
+    global _errortables
+    if _errortables is None:
+        # the syndrome of a error of 1 at each position, and of all error values
+        rows = [ 1 ]
+        for p in range(1, MAXDATALEN):
+            rows.append(_step1(rows[-1], 0))
+        scaled = [ [ _scale(x, e) for e in range(32) ] for x in rows ]
+
+        single = dict()
+        for p, x in enumerate(rows):
+            key, lead = _normalize(x)
+            single[key] = (p, _gfinverse[lead])
+        double = dict()
+        for p1 in range(MAXDATALEN):
+            x1 = rows[p1]
+            for p2 in range(p1+1, MAXDATALEN):
+                row2 = scaled[p2]
+                for e2 in range(1, 32):
+                    key, lead = _normalize(x1 ^ row2[e2])
+                    inv = _gfinverse[lead]
+                    double[key] = (p1, inv, p2, _gfmultable[e2][inv])
+        _errortables = single, double
+    return _errortables
+
+def _locate(syndrome, n, maxerrors):
+    """ find at most 'maxerrors' errors in a data part of 'n' characters, returns a list of ( p, e ) """
+    if not syndrome:
+        return []
+    single, double = _errorsyndromes()
+    key, lead = _normalize(syndrome)
+    m = _gfmultable[lead]
+    hit = single.get(key)
+    if hit:
+        p, e = hit
+        if p < n:
+            return [ (p, m[e]) ]
+        return
+    if maxerrors < 2:
+        return
+    hit = double.get(key)
+    if hit:
+        p1, e1, p2, e2 = hit
+        if p2 < n:
+            return [ (p1, m[e1]), (p2, m[e2]) ]
+
+def correct(txt):
+    """
+    locate and correct up to two wrong characters in the data part of a bech32 or bech32m string.
+    Characters which are not in the bech32 alphabet are treated as errors.
+
+    Returns ( corrected string, list of wrong positions in txt ).
+    Raises an exception when the errors can not be located.
+    """
+    hrp, b32 = splithrp(txt)
+    start = len(txt) - len(b32)
+    if len(b32) > MAXDATALEN:
+        raise Exception("bech32 string too long for error correction")
+    quints = bytearray(b32.encode('ascii', 'replace').translate(_charmap))
+    invalid = [ i for i, q in enumerate(quints) if q == 0xff ]
+    for i in invalid:
+        quints[i] = 0
+
+    chk = bech32_polymod(quints, hrpstate(hrp))
+    n = len(quints)
+    # first look for a single error with either constant, before trying two errors.
+    # when both constants give a solution, prefer the one matching the
+    # witness version: bech32 for version 0, bech32m for the others,
+    # and then the one which leaves the version character unchanged.
+    best = None
+    for maxerrors in (1, 2):
+        for const in (BECH32_CONST, BECH32M_CONST):
+            errors = _locate(chk ^ const, n, maxerrors)
+            if errors is None:
+                continue
+            positions = sorted(set(n-1-p for p, e in errors) | set(invalid))
+            if len(positions) > 2:
+                continue
+            fixed = bytearray(quints)
+            for p, e in errors:
+                fixed[n-1-p] ^= e
+            rank = (len(positions), (fixed[0] == 0) != (const == BECH32_CONST), fixed[0] != quints[0])
+            if best is None or rank < best[2]:
+                best = fixed, positions, rank
+        if best:
+            break
+    if best is None:
+        raise Exception("can not locate the bech32 errors")
+
+    quints, positions, _ = best
+    corrected = txt[:start] + encode32(quints)
+    return corrected, [ start+i for i in positions ]
 
+def locate_errors(txt):
+    """ return the positions of the wrong characters in txt """
+    return correct(txt)[1]
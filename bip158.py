@@ -0,0 +1,271 @@
+"""
+BIP158 compact block filters.
+
+A basic filter contains all output scripts of a block, and the scripts
+of all outputs spent by the block. The scripts are hashed with SipHash-2-4,
+keyed by the block hash, mapped to the range [0, N*M), sorted, and the
+differences encoded with Golomb-Rice coding.
+
+usage:
+    f = GCSFilter.build(blockhash, blk.transactions, spentscripts)
+    f.matchany(myscripts)
+"""
+from __future__ import print_function, division
+import struct
+from io import BytesIO
+
+from bcdataio import Reader, Writer
+from hashing import shasha
+
+P = 19
+M = 784931
+MASK64 = 0xffffffffffffffff
+
+def _rotl(x, b):
+    return ((x << b) | (x >> (64-b))) & MASK64
+
+def siphash(k0, k1, data):
+    """ SipHash-2-4 of 'data', with the key given as two 64 bit integers """
+    v0 = k0 ^ 0x736f6d6570736575
+    v1 = k1 ^ 0x646f72616e646f6d
+    v2 = k0 ^ 0x6c7967656e657261
+    v3 = k1 ^ 0x7465646279746573
+
+    def rounds(v0, v1, v2, v3, n):
+        for _ in range(n):
+            v0 = (v0 + v1) & MASK64
+            v1 = _rotl(v1, 13) ^ v0
+            v0 = _rotl(v0, 32)
+            v2 = (v2 + v3) & MASK64
+            v3 = _rotl(v3, 16) ^ v2
+            v0 = (v0 + v3) & MASK64
+            v3 = _rotl(v3, 21) ^ v0
+            v2 = (v2 + v1) & MASK64
+            v1 = _rotl(v1, 17) ^ v2
+            v2 = _rotl(v2, 32)
+        return v0, v1, v2, v3
+
+    n = len(data)
+    end = n - n%8
+    for i in range(0, end, 8):
+        m, = struct.unpack_from("<Q", data, i)
+        v3 ^= m
+        v0, v1, v2, v3 = rounds(v0, v1, v2, v3, 2)
+        v0 ^= m
+    m = ((n & 0xff) << 56) | int.from_bytes(data[end:], "little")
+    v3 ^= m
+    v0, v1, v2, v3 = rounds(v0, v1, v2, v3, 2)
+    v0 ^= m
+    v2 ^= 0xff
+    v0, v1, v2, v3 = rounds(v0, v1, v2, v3, 4)
+    return v0 ^ v1 ^ v2 ^ v3
+
+
+class BitWriter:
+    """ write bits, most significant first """
+    def __init__(self):
+        self.data = bytearray()
+        self.acc = 0
+        self.nbits = 0
+    def write(self, value, nbits):
+        self.acc = (self.acc << nbits) | value
+        self.nbits += nbits
+        while self.nbits >= 8:
+            self.nbits -= 8
+            self.data.append((self.acc >> self.nbits) & 0xff)
+        self.acc &= (1 << self.nbits)-1
+    def getvalue(self):
+        if self.nbits:
+            return bytes(self.data) + bytes([(self.acc << (8-self.nbits)) & 0xff])
+        return bytes(self.data)
+
+class BitReader:
+    """ read bits, most significant first """
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+        self.acc = 0
+        self.nbits = 0
+    def read(self, nbits):
+        while self.nbits < nbits:
+            if self.pos >= len(self.data):
+                raise Exception("end of filter data")
+            self.acc = (self.acc << 8) | self.data[self.pos]
+            self.pos += 1
+            self.nbits += 8
+        self.nbits -= nbits
+        value = self.acc >> self.nbits
+        self.acc &= (1 << self.nbits)-1
+        return value
+    def readunary(self):
+        n = 0
+        while self.read(1):
+            n += 1
+        return n
+
+
+class GCSFilter:
+    """
+    A golomb coded set, as used by bip158 block filters.
+    'data' is the serialized filter: <varint N> <golomb-rice coded values>
+    """
+    def __init__(self, key, data):
+        self.k0, self.k1 = struct.unpack("<QQ", key[:16])
+        self.data = data
+        r = Reader(BytesIO(data))
+        self.n = r.readvarint() or 0
+        self.f = self.n * M
+        self.bitstart = len(data) - len(r.fh.read())
+
+    def hashitem(self, item):
+        return (siphash(self.k0, self.k1, item) * self.f) >> 64
+
+    @staticmethod
+    def encode(key, items):
+        """ create the serialized filter for a set of items """
+        k0, k1 = struct.unpack("<QQ", key[:16])
+        items = set(items)
+        f = len(items) * M
+        values = sorted((siphash(k0, k1, item) * f) >> 64 for item in items)
+
+        bio = BytesIO()
+        Writer(bio).writevarint(len(values))
+        bw = BitWriter()
+        last = 0
+        for v in values:
+            delta = v - last
+            q = delta >> P
+            # q one bits, followed by a zero bit
+            bw.write((1 << (q+1)) - 2, q+1)
+            bw.write(delta & ((1 << P)-1), P)
+            last = v
+        return bio.getvalue() + bw.getvalue()
+
+    def values(self):
+        """ enumerate the sorted hashed values in the filter """
+        br = BitReader(self.data[self.bitstart:])
+        v = 0
+        for _ in range(self.n):
+            q = br.readunary()
+            v += (q << P) | br.read(P)
+            yield v
+
+    def matchany(self, items):
+        """ check if any of the items is in the filter """
+        if not self.n:
+            return False
+        queries = sorted(self.hashitem(item) for item in items)
+        if not queries:
+            return False
+        qi = 0
+        for v in self.values():
+            while queries[qi] < v:
+                qi += 1
+                if qi == len(queries):
+                    return False
+            if queries[qi] == v:
+                return True
+        return False
+
+    def match(self, item):
+        return self.matchany([item])
+
+    def filterhash(self):
+        return shasha(self.data)
+
+    def header(self, prevheader):
+        """ the filter header, chaining this filter to the previous block's filter header """
+        return shasha(self.filterhash() + prevheader)
+
+    @staticmethod
+    def build(blockhash, transactions, spentscripts):
+        """
+        build the basic filter for a block.
+        'spentscripts' are the scripts of the outputs spent by the block.
+        """
+        return GCSFilter(blockhash, GCSFilter.encode(blockhash, basicfilteritems(transactions, spentscripts)))
+
+
+def basicfilteritems(transactions, spentscripts):
+    """ the set of scripts in a basic filter """
+    items = set()
+    for txn in transactions:
+        for out in txn.outputs:
+            code = out.script.bytecode
+            if code and code[0] != 0x6a:
+                items.add(code)
+    for code in spentscripts:
+        if code:
+            items.add(code)
+    return items
+
+
+class FilterStore:
+    """
+    Append only file of block filters, records are:  <32 byte blockhash> <varint size> <filter>
+    The file position of each filter is kept in memory.
+    """
+    def __init__(self, filename):
+        self.fh = open(filename, "a+b")
+        self.offsets = dict()
+        self.fh.seek(0)
+        r = Reader(self.fh)
+        while True:
+            blockhash = self.fh.read(32)
+            if len(blockhash) < 32:
+                break
+            size = r.readvarint()
+            self.offsets[blockhash] = (self.fh.tell(), size)
+            self.fh.seek(size, 1)
+
+    def add(self, blockhash, data):
+        self.fh.seek(0, 2)
+        self.fh.write(blockhash)
+        Writer(self.fh).writevarint(len(data))
+        self.offsets[blockhash] = (self.fh.tell(), len(data))
+        self.fh.write(data)
+
+    def get(self, blockhash):
+        """ return the GCSFilter for a block, or None """
+        loc = self.offsets.get(blockhash)
+        if loc:
+            self.fh.seek(loc[0])
+            return GCSFilter(blockhash, self.fh.read(loc[1]))
+
+    def close(self):
+        self.fh.close()
+
+
+def main():
+    import argparse
+    import blockfile
+    from prevoutindex import PrevoutIndex
+    parser = argparse.ArgumentParser(description='build bip158 basic block filters')
+    parser.add_argument('--store', type=str, required=True, help='the filter file')
+    parser.add_argument('--prevouts', type=str, required=True, help='prevout index database, see prevoutindex.py')
+    parser.add_argument('PATHS', nargs='+', type=str, help='block files or directories')
+    args = parser.parse_args()
+
+    store = FilterStore(args.store)
+    prevouts = PrevoutIndex(args.prevouts)
+    for path in args.PATHS:
+        for name in blockfile.blockfiles(path):
+            with open(name, "rb") as fh:
+                for pos, data in blockfile.iterblocks(fh):
+                    blk = blockfile.Block.frombytes(data)
+                    blockhash = blk.hash()
+                    if blockhash in store.offsets:
+                        continue
+                    spent = []
+                    for txn in blk.transactions:
+                        if txn.iscoinbase():
+                            continue
+                        for out in prevouts.spentoutputs(txn):
+                            if out is None:
+                                raise Exception("missing prevout in block %s" % blockhash[::-1].hex())
+                            spent.append(out.script.bytecode)
+                    store.add(blockhash, GCSFilter.encode(blockhash, basicfilteritems(blk.transactions, spent)))
+    store.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Reading bitcoin core's blk*.dat block files.
+
+A block file contains a sequence of records:
+    <4 byte network magic>  <4 byte block size>  <block>
+
+A block is an 80 byte header, followed by the transactions.
+Note: block files written by bitcoin core 28 and later may be obfuscated,
+these should be de-obfuscated first.
+"""
+from __future__ import print_function, division
+import os
+import re
+import struct
+from io import BytesIO
+
+from bcdataio import Reader
+from hashing import shasha
+from txndecoder import Transaction
+
+MAGICS = {
+    b"\xf9\xbe\xb4\xd9": "main",
+    b"\x0b\x11\x09\x07": "testnet3",
+    b"\x1c\x16\x3f\x28": "testnet4",
+    b"\x0a\x03\xcf\x40": "signet",
+    b"\xfa\xbf\xb5\xda": "regtest",
+}
+
+class BlockHeader:
+    """ encode, decode a block header """
+    def decode(self, r):
+        self.version = r.readdword()
+        self.prevhash = r.readbytes(32)
+        self.merkleroot = r.readbytes(32)
+        self.time = r.readdword()
+        self.bits = r.readdword()
+        self.nonce = r.readdword()
+    def encode(self, w):
+        w.writedword(self.version)
+        w.writebytes(self.prevhash)
+        w.writebytes(self.merkleroot)
+        w.writedword(self.time)
+        w.writedword(self.bits)
+        w.writedword(self.nonce)
+
+    @staticmethod
+    def frombytes(data):
+        return Reader(BytesIO(data)).readobject(BlockHeader)
+
+class Block:
+    """
+    decode a block.
+
+    'txnspans' has the ( start, end ) offset of each transaction in the block data,
+    'data' has the raw block data, when decoded using `frombytes`.
+    """
+    def decode(self, r):
+        start = r.fh.tell()
+        self.rawheader = r.readbytes(80)
+        self.header = BlockHeader.frombytes(self.rawheader)
+        nrtxn = r.readvarint()
+        self.transactions = []
+        self.txnspans = []
+        for _ in range(nrtxn):
+            txnstart = r.fh.tell()
+            self.transactions.append(r.readobject(Transaction))
+            self.txnspans.append((txnstart-start, r.fh.tell()-start))
+
+    def hash(self):
+        return shasha(self.rawheader)
+
+    def txids(self):
+        """
+        the transaction hashes, non-witness transactions are hashed
+        from the raw block data, without encoding them again.
+        """
+        data = getattr(self, "data", None)
+        if data is None:
+            return [ txn.txid() for txn in self.transactions ]
+        return [ txn.txid() if txn.witness else shasha(data[s:e]) for (s, e), txn in zip(self.txnspans, self.transactions) ]
+
+    @staticmethod
+    def frombytes(data):
+        blk = Reader(BytesIO(data)).readobject(Block)
+        blk.data = data
+        return blk
+
+
+def iterblocks(fh, offset=0):
+    """
+    enumerate the blocks in a block file.
+    yields tuples: ( file offset of the block data, block data )
+    """
+    fh.seek(offset)
+    while True:
+        hdr = fh.read(8)
+        if len(hdr) < 8:
+            break
+        magic, size = struct.unpack("<4sL", hdr)
+        if magic == b"\x00"*4:
+            # the unused, preallocated end of the file.
+            break
+        if magic not in MAGICS:
+            raise Exception("invalid block magic at offset 0x%x" % (fh.tell()-8))
+        pos = fh.tell()
+        data = fh.read(size)
+        if len(data) < size:
+            # block still being written
+            break
+        yield pos, data
+
+def iterblockoffsets(fh, offset=0):
+    """
+    enumerate the position of blocks in a block file, without reading the block data.
+    yields tuples: ( file offset of the block data, size )
+    """
+    fh.seek(0, os.SEEK_END)
+    filesize = fh.tell()
+    pos = offset
+    while pos+8 <= filesize:
+        fh.seek(pos)
+        magic, size = struct.unpack("<4sL", fh.read(8))
+        if magic == b"\x00"*4:
+            break
+        if magic not in MAGICS:
+            raise Exception("invalid block magic at offset 0x%x" % pos)
+        if pos+8+size > filesize:
+            break
+        yield pos+8, size
+        pos += 8+size
+
+def itertransactions(fh):
+    """
+    enumerate all transactions in a block file.
+    yields tuples: ( file offset, length, Transaction )
+    """
+    for pos, data in iterblocks(fh):
+        blk = Block.frombytes(data)
+        for (start, end), txn in zip(blk.txnspans, blk.transactions):
+            yield pos+start, end-start, txn
+
+def blockfiles(path):
+    """
+    return the sorted list of blk*.dat files in a directory,
+    or just the file itself when 'path' is a file.
+    """
+    if os.path.isfile(path):
+        return [path]
+    names = [ n for n in os.listdir(path) if re.match(r'blk\d+\.dat$', n) ]
+    return [ os.path.join(path, n) for n in sorted(names) ]
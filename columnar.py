@@ -0,0 +1,172 @@
+"""
+Export decoded transactions to columnar numpy arrays.
+
+Three structured arrays are created, one row per transaction, input and output,
+and one uint8 array containing all scripts. Inputs and outputs refer to their
+scripts by start and end offset in this array.
+
+The arrays are saved as separate .npy files in a directory, so they can be
+loaded with mmap, or as one .npz file.
+
+usage:
+    exp = ColumnarExporter()
+    for txn in transactions:
+        exp.add(txn)
+    data = exp.finish()
+    data.save("outdir")
+
+    data = ColumnarData.load("outdir")
+    big = data.outputs[data.outputs["value"] > 10**8]
+"""
+from __future__ import print_function, division
+import os
+import struct
+
+import numpy as np
+
+SCRIPTTYPES = [ "nonstandard", "p2pk", "p2pkh", "p2sh", "p2wpkh", "p2wsh", "p2tr", "witness", "multisig", "nulldata" ]
+SCRIPTTYPE_CODE = dict((t, i) for i, t in enumerate(SCRIPTTYPES))
+
+TXN_DTYPE = np.dtype([
+    ("txid", "V32"),
+    ("version", "<u4"),
+    ("locktime", "<u4"),
+    ("firstinput", "<u8"),
+    ("ninputs", "<u4"),
+    ("firstoutput", "<u8"),
+    ("noutputs", "<u4"),
+    ("segwit", "u1"),
+])
+INPUT_DTYPE = np.dtype([
+    ("txindex", "<u8"),
+    ("outpoint", "V36"),
+    ("sequence", "<u4"),
+    ("scriptstart", "<u8"),
+    ("scriptend", "<u8"),
+])
+OUTPUT_DTYPE = np.dtype([
+    ("txindex", "<u8"),
+    ("vout", "<u4"),
+    ("value", "<u8"),
+    ("scripttype", "u1"),
+    ("scriptstart", "<u8"),
+    ("scriptend", "<u8"),
+])
+
+# struct layouts matching the packed numpy dtypes.
+TXN_STRUCT = struct.Struct("<32sLLQLQLB")
+INPUT_STRUCT = struct.Struct("<Q32sLLQQ")
+OUTPUT_STRUCT = struct.Struct("<QLQBQQ")
+
+
+class ColumnarData:
+    """ the columnar arrays """
+    NAMES = ("transactions", "inputs", "outputs", "scripts")
+
+    def __init__(self, transactions, inputs, outputs, scripts):
+        self.transactions = transactions
+        self.inputs = inputs
+        self.outputs = outputs
+        self.scripts = scripts
+
+    def inputscript(self, i):
+        row = self.inputs[i]
+        return self.scripts[row["scriptstart"]:row["scriptend"]].tobytes()
+
+    def outputscript(self, i):
+        row = self.outputs[i]
+        return self.scripts[row["scriptstart"]:row["scriptend"]].tobytes()
+
+    def outputsoftype(self, scripttype):
+        """ boolean mask selecting the outputs with the given script type """
+        return self.outputs["scripttype"] == SCRIPTTYPE_CODE[scripttype]
+
+    def save(self, dirname):
+        """ save as .npy files, which can be loaded with mmap """
+        os.makedirs(dirname, exist_ok=True)
+        for name in self.NAMES:
+            np.save(os.path.join(dirname, name + ".npy"), getattr(self, name))
+
+    def savez(self, filename):
+        np.savez(filename, **dict((name, getattr(self, name)) for name in self.NAMES))
+
+    @staticmethod
+    def load(dirname, mmap_mode="r"):
+        return ColumnarData(*[ np.load(os.path.join(dirname, name + ".npy"), mmap_mode=mmap_mode) for name in ColumnarData.NAMES ])
+
+    @staticmethod
+    def loadz(filename):
+        with np.load(filename) as z:
+            return ColumnarData(*[ z[name] for name in ColumnarData.NAMES ])
+
+
+class ColumnarExporter:
+    """
+    Collect transactions into packed rows, converted to numpy arrays by `finish`.
+    """
+    def __init__(self):
+        self.txns = bytearray()
+        self.inputs = bytearray()
+        self.outputs = bytearray()
+        self.scripts = bytearray()
+        self.ntxns = 0
+        self.ninputs = 0
+        self.noutputs = 0
+
+    def addscript(self, code):
+        start = len(self.scripts)
+        self.scripts += code
+        return start, len(self.scripts)
+
+    def add(self, txn, txid=None):
+        if txid is None:
+            txid = txn.txid()
+        txindex = self.ntxns
+        self.txns += TXN_STRUCT.pack(txid, txn.version, txn.locktime, self.ninputs, len(txn.inputs), self.noutputs, len(txn.outputs), txn.witness is not None)
+        for inp in txn.inputs:
+            start, end = self.addscript(inp.script.bytecode)
+            self.inputs += INPUT_STRUCT.pack(txindex, inp.txn_hash, inp.output_index, inp.sequence_number, start, end)
+        for vout, out in enumerate(txn.outputs):
+            code = out.script.bytecode
+            start, end = self.addscript(code)
+            scripttype = SCRIPTTYPE_CODE[out.script.classify()[0]]
+            self.outputs += OUTPUT_STRUCT.pack(txindex, vout, out.btcvalue, scripttype, start, end)
+        self.ntxns += 1
+        self.ninputs += len(txn.inputs)
+        self.noutputs += len(txn.outputs)
+
+    def addmany(self, txns):
+        for txn in txns:
+            self.add(txn)
+
+    def finish(self):
+        return ColumnarData(
+            np.frombuffer(bytes(self.txns), dtype=TXN_DTYPE),
+            np.frombuffer(bytes(self.inputs), dtype=INPUT_DTYPE),
+            np.frombuffer(bytes(self.outputs), dtype=OUTPUT_DTYPE),
+            np.frombuffer(bytes(self.scripts), dtype=np.uint8))
+
+
+def main():
+    import argparse
+    import blockfile
+    parser = argparse.ArgumentParser(description='export block files to numpy arrays')
+    parser.add_argument('--output', '-o', type=str, required=True, help='output directory, or .npz file')
+    parser.add_argument('PATHS', nargs='+', type=str, help='block files or directories')
+    args = parser.parse_args()
+
+    exp = ColumnarExporter()
+    for path in args.PATHS:
+        for name in blockfile.blockfiles(path):
+            with open(name, "rb") as fh:
+                for _, _, txn in blockfile.itertransactions(fh):
+                    exp.add(txn)
+    data = exp.finish()
+    if args.output.endswith(".npz"):
+        data.savez(args.output)
+    else:
+        data.save(args.output)
+    print("%d transactions, %d inputs, %d outputs, %d script bytes" % (len(data.transactions), len(data.inputs), len(data.outputs), len(data.scripts)))
+
+if __name__ == '__main__':
+    main()
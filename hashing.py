@@ -2,39 +2,252 @@
 By Willem Hengeveld <itsme@xs4all.nl>
 
 two hashing operations used by bitcoin
+
+The hash implementation is selected at import, the first available in this fixed
+order is used:
+  * hashlib       - sha256 and ripemd160 from the standard library,
+                    openssl3 builds often don't have ripemd160.
+  * pycryptodome  - Crypto.Hash or Cryptodome.Hash
+  * python        - hashlib's sha256 with the pure python ripemd160 from ripemd.py
+
+The selection can be overridden with the BCUTILS_HASH_BACKEND environment variable,
+or with `setbackend`.
+When the chosen backend lacks ripemd160, the next one which has it is used for that.
+
+`sharip_many` and `shasha_many` hash batches of small items, optionally using a process pool.
+
+`python3 hashing.py` compares the speed of the available backends.
 """
+import hashlib
+import os
+
 try:
     from Crypto.Hash import  SHA256, RIPEMD160
 except ImportError:
-    from Cryptodome.Hash import  SHA256, RIPEMD160
+    try:
+        from Cryptodome.Hash import  SHA256, RIPEMD160
+    except ImportError:
+        SHA256 = RIPEMD160 = None
+
+import ripemd
+
+
+def _hashlib_ripemd160():
+    try:
+        hashlib.new('ripemd160')
+    except ValueError:
+        return
+    return lambda data=b"": hashlib.new('ripemd160', data)
+
+def _backends():
+    """ returns a dict: name -> ( sha256 constructor, ripemd160 constructor or None ) """
+    backends = dict()
+    backends["hashlib"] = (hashlib.sha256, _hashlib_ripemd160())
+    if SHA256:
+        backends["pycryptodome"] = (SHA256.new, RIPEMD160.new)
+    backends["python"] = (hashlib.sha256, ripemd.new)
+    return backends
+
+BACKENDS = _backends()
+
+def availablebackends():
+    """ the names of the backends which have both sha256 and ripemd160 """
+    return [ name for name, (s, r) in BACKENDS.items() if r ]
+
+def setbackend(name=None):
+    """
+    select the hash implementation, by default the first available in the order of BACKENDS.
+    """
+    global _sha256, _ripemd160, BACKEND
+    if not name or name == "auto":
+        name = availablebackends()[0]
+    if name not in BACKENDS:
+        raise Exception("unknown hash backend: %s" % name)
+    _sha256, _ripemd160 = BACKENDS[name]
+    if not _ripemd160:
+        _ripemd160 = BACKENDS[availablebackends()[0]][1]
+    BACKEND = name
+    _tagmidstates.clear()
+
+_tagmidstates = dict()
+
+setbackend(os.environ.get("BCUTILS_HASH_BACKEND"))
+
 
 def sha256(*data):
     """ Calculate a sha256 """
-    h1 = SHA256.new()
+    if len(data) == 1:
+        return _sha256(data[0]).digest()
+    h1 = _sha256()
     for x in data:
         h1.update(x)
-    
+
     return h1.digest()
 
+def sha256ctx(*data):
+    """ return a sha256 context, which can be updated further, or copied """
+    h1 = _sha256()
+    for x in data:
+        h1.update(x)
+
+    return h1
+
 def shasha(*data):
     """ Calculate a transaction hash """
-    h1 = SHA256.new()
+    if len(data) == 1:
+        return _sha256(_sha256(data[0]).digest()).digest()
+    h1 = _sha256()
     for x in data:
         h1.update(x)
-    
-    h2 = SHA256.new()
-    h2.update( h1.digest() )
 
-    return h2.digest()
+    return _sha256(h1.digest()).digest()
+
+class Midstate:
+    """
+    A sha256 state after hashing a fixed prefix.
+
+    Hashing a message starting with that prefix only copies the state,
+    instead of rehashing the prefix:
+
+        m = Midstate(header[:76])
+        for nonce in range(...):
+            h = m.shasha(struct.pack("<L", nonce))
+    """
+    def __init__(self, *prefix):
+        self.ctx = sha256ctx(*prefix)
+
+    def extend(self, *data):
+        """ return a new Midstate, for the prefix followed by 'data' """
+        m = Midstate()
+        m.ctx = self.context(*data)
+        return m
+
+    def context(self, *data):
+        """ return a sha256 context containing the prefix and 'data' """
+        h = self.ctx.copy()
+        for x in data:
+            h.update(x)
+        return h
+
+    def sha256(self, *data):
+        """ sha256 of the prefix followed by 'data' """
+        return self.context(*data).digest()
+
+    def shasha(self, *data):
+        """ double sha256 of the prefix followed by 'data' """
+        return _sha256(self.context(*data).digest()).digest()
+
+def tagmidstate(tag):
+    """ return the cached Midstate after the bip340 tag prefix: sha256(tag) || sha256(tag) """
+    m = _tagmidstates.get(tag)
+    if m is None:
+        t = tag.encode('ascii') if type(tag)==str else tag
+        taghash = sha256(t)
+        m = _tagmidstates[tag] = Midstate(taghash, taghash)
+    return m
+
+def taggedhash(tag, *data):
+    """ Calculate a bip340 tagged hash: sha256(sha256(tag) || sha256(tag) || data) """
+    return tagmidstate(tag).sha256(*data)
+
+def ripemd160(data):
+    """ Calculate a ripemd160 """
+    return _ripemd160(data).digest()
 
 def sharip(data):
     """ Calculate a address hash """
-    h1 = SHA256.new()
-    h1.update(data)
-    
-    h2 = RIPEMD160.new()
-    h2.update( h1.digest() )
+    return _ripemd160(_sha256(data).digest()).digest()
+
+
+# the bulk functions copy an empty hash context for each item, this avoids
+# the constructor overhead, which for short items is larger than the hashing itself.
+
+def _sharip_list(items):
+    newsha, newrip = _sha256().copy, _ripemd160().copy
+    hashes = []
+    for x in items:
+        h = newsha()
+        h.update(x)
+        r = newrip()
+        r.update(h.digest())
+        hashes.append(r.digest())
+    return hashes
+
+def _shasha_list(items):
+    newsha = _sha256().copy
+    hashes = []
+    for x in items:
+        h = newsha()
+        h.update(x)
+        h2 = newsha()
+        h2.update(h.digest())
+        hashes.append(h2.digest())
+    return hashes
+
+def _sharip_bytes(items):
+    return b"".join(_sharip_list(items))
+
+def _shasha_bytes(items):
+    return b"".join(_shasha_list(items))
+
+def _hashmany(items, listfn, bytesfn, processes, concat, chunksize):
+    if not processes:
+        hashes = listfn(items)
+        return b"".join(hashes) if concat else hashes
+
+    import multiprocessing
+    items = list(items)
+    chunks = [ items[i:i+chunksize] for i in range(0, len(items), chunksize) ]
+    with multiprocessing.Pool(processes, initializer=setbackend, initargs=(BACKEND,)) as pool:
+        # the workers return one bytes object per chunk, that is much cheaper to pickle than a list.
+        data = b"".join(pool.map(bytesfn, chunks))
+    if concat or not items:
+        return data if concat else []
+    size = len(data)//len(items)
+    return [ data[i:i+size] for i in range(0, len(data), size) ]
+
+def sharip_many(items, processes=None, concat=False, chunksize=0x10000):
+    """
+    Calculate the address hash for each item.
+
+    Returns a list of 20 byte hashes, or with 'concat' a single bytes object,
+    with the hash for item i at offset 20*i.
+    With 'processes', the items are hashed in chunks by a process pool.
+    """
+    return _hashmany(items, _sharip_list, _sharip_bytes, processes, concat, chunksize)
+
+def shasha_many(items, processes=None, concat=False, chunksize=0x10000):
+    """
+    Calculate the double sha256 for each item.
+
+    Returns a list of 32 byte hashes, or with 'concat' a single bytes object,
+    with the hash for item i at offset 32*i.
+    With 'processes', the items are hashed in chunks by a process pool.
+    """
+    return _hashmany(items, _shasha_list, _shasha_bytes, processes, concat, chunksize)
 
-    return h2.digest()
 
+def benchmark(count=100000):
+    """ print the time per call of sha256, shasha and sharip, for each backend """
+    import timeit
+    pubkey = bytes.fromhex("0279be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798")
+    header = bytes(80)
+    current = BACKEND
+    print("%-14s %12s %12s %12s" % ("backend", "sha256(33)", "shasha(80)", "sharip(33)"))
+    try:
+        for name in availablebackends():
+            setbackend(name)
+            n = count if name != "python" else count//100
+            times = [ timeit.timeit(lambda: fn(arg), number=n) / n * 1E6 for fn, arg in ((sha256, pubkey), (shasha, header), (sharip, pubkey)) ]
+            print("%-14s %10.2fus %10.2fus %10.2fus" % (name, *times))
+        setbackend(current)
+        keys = [ pubkey ] * count
+        t = timeit.timeit(lambda: [ sharip(k) for k in keys ], number=1) / count * 1E6
+        print("%-14s %10.2fus" % ("sharip loop", t))
+        t = timeit.timeit(lambda: sharip_many(keys), number=1) / count * 1E6
+        print("%-14s %10.2fus" % ("sharip_many", t))
+    finally:
+        setbackend(current)
 
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,314 @@
+"""
+Validate a chain of block headers.
+
+The headers are kept packed, 80 bytes each, in height order, in one bytearray.
+The block hashes are kept in a second bytearray, 32 bytes each.
+`HeaderChain.fields` provides numpy views on the version, time and bits columns.
+When numpy is available, `validate` checks the columns with vectorized operations,
+only the rare hashes close to their target are compared as python integers.
+
+Validation checks:
+  - each header links to the hash of the previous header.
+  - the block hash is below the target encoded in 'bits'.
+  - optionally, the mainnet difficulty adjustment every 2016 blocks.
+and calculates the cumulative work.
+
+usage:
+    python3 headers.py --dump headers.bin
+    python3 headers.py ~/.bitcoin/blocks
+"""
+from __future__ import print_function, division
+from collections import defaultdict
+import struct
+
+from hashing import shasha
+
+HEADERSIZE = 80
+POWLIMIT = 0xffff << 208
+RETARGET_INTERVAL = 2016
+TARGET_TIMESPAN = 14*24*3600
+
+def targetfrombits(bits):
+    """ decode the compact target representation """
+    exponent = bits >> 24
+    mantissa = bits & 0x7fffff
+    if bits & 0x800000:
+        raise Exception("negative target")
+    if exponent <= 3:
+        return mantissa >> 8*(3-exponent)
+    return mantissa << 8*(exponent-3)
+
+def bitsfromtarget(target):
+    """ encode a target in compact form """
+    size = (target.bit_length()+7)//8
+    if size <= 3:
+        mantissa = target << 8*(3-size)
+    else:
+        mantissa = target >> 8*(size-3)
+    if mantissa & 0x800000:
+        mantissa >>= 8
+        size += 1
+    return (size << 24) | mantissa
+
+def workfromtarget(target):
+    return (1 << 256) // (target+1)
+
+def headerwork(header):
+    """ the work of a header, 0 when its bits are invalid """
+    try:
+        return workfromtarget(targetfrombits(struct.unpack_from("<L", header, 72)[0]))
+    except Exception:
+        return 0
+
+
+class HeaderChain:
+    """
+    A list of block headers in height order.
+    """
+    def __init__(self, data=b""):
+        if len(data) % HEADERSIZE:
+            raise Exception("header data is not a multiple of 80 bytes")
+        self.data = bytearray(data)
+        self.hashes = bytearray()
+        self.totalwork = 0
+
+    def __len__(self):
+        return len(self.data)//HEADERSIZE
+
+    def header(self, height):
+        return bytes(self.data[height*HEADERSIZE:(height+1)*HEADERSIZE])
+
+    def blockhash(self, height):
+        return bytes(self.hashes[height*32:(height+1)*32])
+
+    def append(self, header):
+        try:
+            self.data += header
+        except BufferError:
+            raise Exception("release the numpy views from fields() before appending")
+
+    def calchashes(self):
+        """ calculate the hashes for all headers not hashed yet """
+        data = memoryview(self.data)
+        n = len(self.hashes)//32
+        self.hashes += b"".join(shasha(data[i:i+HEADERSIZE]) for i in range(n*HEADERSIZE, len(data), HEADERSIZE))
+
+    def fields(self):
+        """
+        return a numpy structured array view on the headers, the data is not copied.
+        While the view exists the bytearray can not grow: release it before calling `append`.
+        """
+        import numpy as np
+        dtype = np.dtype([("version", "<i4"), ("prevhash", "V32"), ("merkleroot", "V32"), ("time", "<u4"), ("bits", "<u4"), ("nonce", "<u4")])
+        return np.frombuffer(self.data, dtype=dtype)
+
+    def validate(self, checkretarget=False):
+        """
+        Check all headers, returns a list of ( height, error message ).
+        Also sets 'totalwork'.
+        """
+        self.calchashes()
+        try:
+            import numpy
+        except ImportError:
+            return self._validateloop(checkretarget)
+        return self._validatecolumns(checkretarget)
+
+    def _validatecolumns(self, checkretarget):
+        import numpy as np
+        n = len(self)
+        self.totalwork = 0
+        if not n:
+            return []
+        # views on the headers and hashes, these are released when returning.
+        cols = self.fields()
+        hashes = np.frombuffer(self.hashes, dtype="V32")
+        # the most significant 64 bits of the little endian hashes
+        hashtop = hashes.view("<u8")[3::4]
+
+        # the checks are collected per kind, and sorted by height at the end.
+        errors = []
+        bad = np.nonzero(cols["prevhash"][1:] != hashes[:-1])[0] + 1
+        errors.extend((int(h), "prevhash mismatch") for h in bad)
+
+        # the targets are calculated once for each distinct 'bits' value.
+        bits = cols["bits"]
+        ubits, inverse = np.unique(bits, return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(ubits))
+        valid = np.ones(len(ubits), dtype=bool)
+        targettop = np.zeros(len(ubits), dtype="<u8")
+        targets = []
+        totalwork = 0
+        for i, b in enumerate(ubits):
+            try:
+                target = targetfrombits(int(b))
+            except Exception as e:
+                valid[i] = False
+                targets.append(None)
+                errors.extend((int(h), str(e)) for h in np.nonzero(inverse == i)[0])
+                continue
+            targets.append(target)
+            targettop[i] = min(target >> 192, (1 << 64) - 1)
+            totalwork += workfromtarget(target) * int(counts[i])
+        validheight = valid[inverse]
+
+        for i in np.nonzero(valid)[0]:
+            if targets[i] > POWLIMIT:
+                errors.extend((int(h), "target above proof of work limit") for h in np.nonzero(inverse == i)[0])
+
+        top = targettop[inverse]
+        above = (hashtop > top) & validheight
+        # for an equal top 64 bits, the full values decide.
+        for h in np.nonzero((hashtop == top) & validheight)[0]:
+            above[h] = int.from_bytes(self.blockhash(h), "little") > targets[inverse[h]]
+        errors.extend((int(h), "hash above target") for h in np.nonzero(above)[0])
+
+        if checkretarget and n > 1:
+            heights = np.arange(1, n)
+            changed = (bits[1:] != bits[:-1]) & (heights % RETARGET_INTERVAL != 0) & validheight[1:] & validheight[:-1]
+            errors.extend((int(h), "bits %08x, expected %08x" % (bits[h], bits[h-1])) for h in np.nonzero(changed)[0] + 1)
+            for h in range(RETARGET_INTERVAL, n, RETARGET_INTERVAL):
+                if not (validheight[h] and validheight[h-1]):
+                    continue
+                expected = self.expectedbits(h, int(bits[h-1]))
+                if bits[h] != expected:
+                    errors.append((h, "bits %08x, expected %08x" % (bits[h], expected)))
+
+        self.totalwork = totalwork
+        errors.sort(key=lambda e: e[0])
+        return errors
+
+    def _validateloop(self, checkretarget):
+        errors = []
+        data = self.data
+        hashes = self.hashes
+        targets = dict()
+        totalwork = 0
+        prevbits = None
+        for height in range(len(self)):
+            o = height*HEADERSIZE
+            h = hashes[height*32:(height+1)*32]
+            if height and data[o+4:o+36] != hashes[(height-1)*32:height*32]:
+                errors.append((height, "prevhash mismatch"))
+
+            bits, = struct.unpack_from("<L", data, o+72)
+            tw = targets.get(bits)
+            if tw is None:
+                try:
+                    target = targetfrombits(bits)
+                except Exception as e:
+                    errors.append((height, str(e)))
+                    prevbits = bits
+                    continue
+                tw = targets[bits] = (target, workfromtarget(target))
+            target, work = tw
+            if target > POWLIMIT:
+                errors.append((height, "target above proof of work limit"))
+            if int.from_bytes(h, "little") > target:
+                errors.append((height, "hash above target"))
+            totalwork += work
+
+            # the retarget is not checked after a header with invalid bits, those are already reported.
+            if checkretarget and height and prevbits in targets:
+                expected = self.expectedbits(height, prevbits)
+                if bits != expected:
+                    errors.append((height, "bits %08x, expected %08x" % (bits, expected)))
+            prevbits = bits
+        self.totalwork = totalwork
+        return errors
+
+    def time(self, height):
+        return struct.unpack_from("<L", self.data, height*HEADERSIZE+68)[0]
+
+    def expectedbits(self, height, prevbits):
+        """ the mainnet difficulty adjustment """
+        if height % RETARGET_INTERVAL:
+            return prevbits
+        timespan = self.time(height-1) - self.time(height-RETARGET_INTERVAL)
+        timespan = min(max(timespan, TARGET_TIMESPAN//4), TARGET_TIMESPAN*4)
+        target = min(targetfrombits(prevbits) * timespan // TARGET_TIMESPAN, POWLIMIT)
+        return bitsfromtarget(target)
+
+    @staticmethod
+    def fromdump(filename):
+        """ load a file containing the concatenated 80 byte headers, in height order """
+        with open(filename, "rb") as fh:
+            return HeaderChain(fh.read())
+
+    @staticmethod
+    def fromunordered(headers):
+        """
+        build the chain with the most work from headers in arbitrary order,
+        like those found in block files.
+        """
+        byhash = dict()
+        children = defaultdict(list)
+        for hdr in headers:
+            h = shasha(hdr)
+            byhash[h] = hdr
+            children[hdr[4:36]].append(h)
+
+        # walk the tree from the roots: headers whose parent is unknown.
+        work = dict()
+        stack = [ h for h, hdr in byhash.items() if hdr[4:36] not in byhash ]
+        for h in stack:
+            work[h] = 0
+        besttip, bestwork = None, -1
+        while stack:
+            h = stack.pop()
+            # headers with invalid bits add no work, `validate` reports them.
+            w = work[h] + headerwork(byhash[h])
+            work[h] = w
+            if w > bestwork:
+                besttip, bestwork = h, w
+            for child in children.get(h, ()):
+                work[child] = w
+                stack.append(child)
+
+        chain = []
+        h = besttip
+        while h in byhash:
+            chain.append(byhash[h])
+            h = byhash[h][4:36]
+        return HeaderChain(b"".join(chain[::-1]))
+
+    @staticmethod
+    def fromblockfiles(paths):
+        import blockfile
+        def headers():
+            for path in paths:
+                for name in blockfile.blockfiles(path):
+                    with open(name, "rb") as fh:
+                        for pos, size in blockfile.iterblockoffsets(fh):
+                            fh.seek(pos)
+                            yield fh.read(HEADERSIZE)
+        return HeaderChain.fromunordered(headers())
+
+
+def main():
+    import argparse
+    import time
+    from binascii import b2a_hex
+    parser = argparse.ArgumentParser(description='validate a chain of block headers')
+    parser.add_argument('--dump', type=str, help='file with concatenated 80 byte headers')
+    parser.add_argument('--retarget', action='store_true', help='check the mainnet difficulty adjustments')
+    parser.add_argument('PATHS', nargs='*', type=str, help='block files or directories')
+    args = parser.parse_args()
+
+    t0 = time.time()
+    if args.dump:
+        chain = HeaderChain.fromdump(args.dump)
+    else:
+        chain = HeaderChain.fromblockfiles(args.PATHS)
+    t1 = time.time()
+    errors = chain.validate(args.retarget)
+    t2 = time.time()
+    for height, msg in errors:
+        print("%7d: %s" % (height, msg))
+    if len(chain):
+        print("tip: height %d, %s" % (len(chain)-1, b2a_hex(chain.blockhash(len(chain)-1)[::-1]).decode('ascii')))
+    print("%d headers, %d errors, total work 0x%x" % (len(chain), len(errors), chain.totalwork))
+    print("loaded in %.1f seconds, validated in %.1f seconds" % (t1-t0, t2-t1))
+
+if __name__ == '__main__':
+    main()
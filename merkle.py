@@ -0,0 +1,108 @@
+"""
+Merkle trees of transaction hashes, as used in bitcoin blocks.
+
+Each level is calculated from the level below by double-sha256 hashing
+pairs of hashes, the last hash of an odd sized level is paired with itself.
+All pairs of a level are hashed with one `shasha_many` call.
+
+usage:
+    root = merkleroot(txids)
+
+    tree = MerkleTree(txids)
+    proof = tree.proof(5)
+    verifyproof(txids[5], 5, proof, tree.root())
+"""
+from __future__ import print_function, division
+from hashing import shasha, shasha_many
+
+def nextlevel(level):
+    """ calculate the hashes of the next level, hashing all pairs in one `shasha_many` call """
+    if len(level)%2:
+        level = level + level[-1:]
+    data = b"".join(level)
+    return shasha_many([ data[i:i+64] for i in range(0, len(data), 64) ])
+
+def merkleroot(hashes):
+    """ calculate the merkle root of a list of hashes """
+    level = list(hashes)
+    if not level:
+        raise Exception("empty merkle tree")
+    while len(level) > 1:
+        level = nextlevel(level)
+    return level[0]
+
+def verifyproof(leaf, index, proof, root):
+    """ check that 'leaf' is at position 'index' in the tree with 'root' """
+    h = leaf
+    for sibling in proof:
+        if index & 1:
+            h = shasha(sibling + h)
+        else:
+            h = shasha(h + sibling)
+        index >>= 1
+    return h == root
+
+
+class MerkleTree:
+    """
+    A merkle tree, keeping all intermediate levels,
+    so proofs and updates need only log(n) hashes.
+    """
+    def __init__(self, leaves):
+        self.levels = [ list(leaves) ]
+        if not self.levels[0]:
+            raise Exception("empty merkle tree")
+        while len(self.levels[-1]) > 1:
+            self.levels.append(nextlevel(self.levels[-1]))
+
+    def root(self):
+        return self.levels[-1][0]
+
+    def proof(self, index):
+        """ return the list of sibling hashes, from the leaf up to the root """
+        proof = []
+        for level in self.levels[:-1]:
+            sibling = index ^ 1
+            proof.append(level[sibling] if sibling < len(level) else level[index])
+            index >>= 1
+        return proof
+
+    def update(self, index, leaf):
+        """ replace a leaf, and recalculate the path to the root """
+        self.levels[0][index] = leaf
+        for lvl in range(1, len(self.levels)):
+            below = self.levels[lvl-1]
+            left = index & ~1
+            right = left+1 if left+1 < len(below) else left
+            index >>= 1
+            self.levels[lvl][index] = shasha(below[left] + below[right])
+
+
+def checkblock(blk):
+    """ check the merkle root of a `blockfile.Block` """
+    return merkleroot(blk.txids()) == blk.header.merkleroot
+
+def main():
+    import argparse
+    import time
+    import blockfile
+    from binascii import b2a_hex
+    parser = argparse.ArgumentParser(description='check the merkle roots of all blocks in block files')
+    parser.add_argument('PATHS', nargs='+', type=str, help='block files or directories')
+    args = parser.parse_args()
+
+    t0 = time.time()
+    nblocks = nbad = 0
+    for path in args.PATHS:
+        for name in blockfile.blockfiles(path):
+            with open(name, "rb") as fh:
+                for pos, data in blockfile.iterblocks(fh):
+                    blk = blockfile.Block.frombytes(data)
+                    nblocks += 1
+                    if not checkblock(blk):
+                        nbad += 1
+                        print("%s:%08x: block %s has an invalid merkle root" % (name, pos, b2a_hex(blk.hash()[::-1]).decode('ascii')))
+    print("checked %d blocks, %d bad, in %.1f seconds" % (nblocks, nbad, time.time()-t0))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Decode and analyse block files in parallel, using a pool of worker processes.
+
+The block files are split into jobs of a number of blocks. Each worker decodes
+the blocks of a job, and passes each transaction ( or each block ) to a
+user supplied map function. Only the results of the map function are
+sent back to the main process, not the decoded transactions.
+
+The map function must be picklable, so defined at module level.
+
+usage:
+    def outputtypes(txn):
+        return [ out.script.classify()[0] for out in txn.outputs ]
+
+    p = Pipeline(outputtypes, workers=32)
+    for result in p.run(["~/.bitcoin/blocks"]):
+        ...
+"""
+from __future__ import print_function, division
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque
+import os
+
+import blockfile
+
+def makejobs(paths, blocksperjob=64):
+    """
+    split the block files into jobs.
+    yields tuples: ( filename, [ ( offset, size ), ... ] )
+    """
+    for path in paths:
+        for name in blockfile.blockfiles(os.path.expanduser(path)):
+            with open(name, "rb") as fh:
+                blocks = []
+                for pos, size in blockfile.iterblockoffsets(fh):
+                    blocks.append((pos, size))
+                    if len(blocks) == blocksperjob:
+                        yield name, blocks
+                        blocks = []
+                if blocks:
+                    yield name, blocks
+
+def runjob(job, mapfn, perblock=False):
+    """ executed in the worker: decode the blocks of a job, return the list of mapped results """
+    name, blocks = job
+    results = []
+    with open(name, "rb") as fh:
+        for pos, size in blocks:
+            fh.seek(pos)
+            blk = blockfile.Block.frombytes(fh.read(size))
+            if perblock:
+                results.append(mapfn(blk))
+            else:
+                results.extend(mapfn(txn) for txn in blk.transactions)
+    return results
+
+
+class Pipeline:
+    """
+    Run 'mapfn' over all transactions in a set of block files.
+
+    ordered     - when True results are returned in block file order, otherwise in order of completion.
+    perblock    - pass decoded `blockfile.Block` objects to mapfn instead of transactions.
+    maxpending  - the maximum number of jobs queued or running, limiting memory use
+                  when results are consumed slower than they are produced.
+    """
+    def __init__(self, mapfn, workers=None, ordered=True, perblock=False, blocksperjob=64, maxpending=None):
+        self.mapfn = mapfn
+        self.workers = workers or os.cpu_count()
+        self.ordered = ordered
+        self.perblock = perblock
+        self.blocksperjob = blocksperjob
+        self.maxpending = maxpending or 2*self.workers
+
+    def runjobs(self, paths):
+        """ yields the list of results for each job """
+        jobs = makejobs(paths, self.blocksperjob)
+        with ProcessPoolExecutor(self.workers) as pool:
+            pending = deque()
+
+            def fill():
+                while len(pending) < self.maxpending:
+                    job = next(jobs, None)
+                    if job is None:
+                        break
+                    pending.append(pool.submit(runjob, job, self.mapfn, self.perblock))
+
+            fill()
+            while pending:
+                if self.ordered:
+                    fut = pending.popleft()
+                else:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    fut = done.pop()
+                    pending.remove(fut)
+                results = fut.result()
+                fill()
+                yield results
+
+    def run(self, paths):
+        """ yields the results of mapfn for each transaction or block """
+        for results in self.runjobs(paths):
+            for r in results:
+                yield r
+
+
+def outputtypes(txn):
+    """ example map function: the types of all output scripts """
+    return [ out.script.classify()[0] for out in txn.outputs ]
+
+def main():
+    import argparse
+    import time
+    from collections import Counter
+    parser = argparse.ArgumentParser(description='parallel histogram of output script types')
+    parser.add_argument('--workers', '-j', type=int)
+    parser.add_argument('--unordered', action='store_true')
+    parser.add_argument('PATHS', nargs='+', type=str, help='block files or directories')
+    args = parser.parse_args()
+
+    t0 = time.time()
+    hist = Counter()
+    ntxns = 0
+    p = Pipeline(outputtypes, workers=args.workers, ordered=not args.unordered)
+    for types in p.run(args.PATHS):
+        hist.update(types)
+        ntxns += 1
+    for t, n in hist.most_common():
+        print("%-12s %10d" % (t, n))
+    print("%d transactions in %.1f seconds" % (ntxns, time.time()-t0))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+An on-disk index of transaction outputs: ( txid, vout ) -> ( value, scriptPubKey )
+
+Needed for calculating segwit message hashes, which commit to the value of the spent output.
+
+The index is stored in a sqlite database, with the 36 byte outpoint as key.
+Outputs are written in batches, and lookups go through a LRU cache.
+
+usage:
+    python3 prevoutindex.py --db prevouts.db ~/.bitcoin/blocks
+    python3 prevoutindex.py --db prevouts.db --lookup <txid>:<vout>
+"""
+from __future__ import print_function, division
+from collections import OrderedDict
+import sqlite3
+import struct
+
+from txndecoder import Output, Script
+
+class PrevoutIndex:
+    """
+    Map outpoints to the `Output` they refer to.
+    """
+    def __init__(self, filename, cachesize=100000, batchsize=20000):
+        self.db = sqlite3.connect(filename)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=OFF")
+        self.db.execute("CREATE TABLE IF NOT EXISTS prevouts (outpoint BLOB PRIMARY KEY, value INTEGER, script BLOB) WITHOUT ROWID")
+        self.cachesize = cachesize
+        self.cache = OrderedDict()
+        self.batchsize = batchsize
+        self.pending = dict()
+
+    @staticmethod
+    def outpoint(txid, vout):
+        return txid + struct.pack("<L", vout)
+
+    def add_transaction(self, txn, txid=None):
+        """ add all outputs of 'txn' """
+        if txid is None:
+            txid = txn.txid()
+        for vout, out in enumerate(txn.outputs):
+            self.pending[self.outpoint(txid, vout)] = (out.btcvalue, out.script.bytecode)
+        if len(self.pending) >= self.batchsize:
+            self.flush()
+
+    def add_transactions(self, txns):
+        for txn in txns:
+            self.add_transaction(txn)
+        self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO prevouts VALUES (?,?,?)", ((k, v, s) for k, (v, s) in self.pending.items()))
+        self.pending = dict()
+
+    def lookup(self, txid, vout):
+        """ return the `Output` for outpoint ( txid, vout ), or None """
+        key = self.outpoint(txid, vout)
+        out = self.cache.get(key)
+        if out is not None:
+            self.cache.move_to_end(key)
+            return out
+        row = self.pending.get(key)
+        if row is None:
+            row = self.db.execute("SELECT value, script FROM prevouts WHERE outpoint=?", (key,)).fetchone()
+            if row is None:
+                return
+        out = Output()
+        out.btcvalue = row[0]
+        out.script = Script()
+        out.script.bytecode = bytes(row[1])
+
+        self.cache[key] = out
+        if len(self.cache) > self.cachesize:
+            self.cache.popitem(last=False)
+        return out
+
+    def spentoutputs(self, txn):
+        """ return the list of outputs spent by 'txn', None for unknown outputs """
+        return [ self.lookup(inp.txn_hash, inp.output_index) for inp in txn.inputs ]
+
+    def __len__(self):
+        self.flush()
+        return self.db.execute("SELECT COUNT(*) FROM prevouts").fetchone()[0]
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+
+def main():
+    import argparse
+    import blockfile
+    from binascii import a2b_hex
+    parser = argparse.ArgumentParser(description='build or query a prevout index')
+    parser.add_argument('--db', type=str, required=True, help='the index database')
+    parser.add_argument('--lookup', type=str, help='txid:vout, txid in the usual reversed hex order')
+    parser.add_argument('--verbose', '-v', action='store_true')
+    parser.add_argument('PATHS', nargs='*', type=str, help='block files or directories')
+    args = parser.parse_args()
+
+    idx = PrevoutIndex(args.db)
+    if args.lookup:
+        txid, vout = args.lookup.split(":")
+        out = idx.lookup(a2b_hex(txid)[::-1], int(vout))
+        if out:
+            print("%d %s" % (out.btcvalue, out.script.bytecode.hex()))
+        else:
+            print("not found")
+
+    for path in args.PATHS:
+        for fn in blockfile.blockfiles(path):
+            if args.verbose:
+                print(fn)
+            with open(fn, "rb") as fh:
+                for _, _, txn in blockfile.itertransactions(fh):
+                    idx.add_transaction(txn)
+    idx.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,620 @@
+"""
+Evaluate bitcoin scripts.
+
+Supports the legacy and segwit-v0 script rules, signatures are checked
+using myecdsa, message hashes are calculated using bcsigutils.
+Taproot spends are not supported, since there is no schnorr verification.
+
+Valid signatures are kept in a bounded cache, keyed by ( sighash, pubkey, signature ),
+so verifying the same inputs again costs no ec operations.
+
+usage:
+    engine = ScriptEngine()
+    ok = engine.verify_transaction(txn, prevouts)
+    for line in engine.report(): print(line)
+"""
+from __future__ import print_function, division
+from collections import OrderedDict, defaultdict
+import hashlib
+import time
+
+import myecdsa
+import convert
+from hashing import sha256, shasha, sharip, ripemd160
+from txndecoder import Script, iterops, classify_bytecode
+from bcsigutils import decode_der, LegacySighash, SighashCache
+
+class ScriptError(Exception):
+    """ raised when a script fails """
+    pass
+
+OPNAMES = {
+    0x00:"0", 0x4c:"PUSHDATA1", 0x4d:"PUSHDATA2", 0x4e:"PUSHDATA4", 0x4f:"1NEGATE", 0x50:"RESERVED",
+    0x61:"NOP", 0x62:"VER", 0x63:"IF", 0x64:"NOTIF", 0x65:"VERIF", 0x66:"VERNOTIF", 0x67:"ELSE", 0x68:"ENDIF",
+    0x69:"VERIFY", 0x6a:"RETURN", 0x6b:"TOALTSTACK", 0x6c:"FROMALTSTACK", 0x6d:"2DROP", 0x6e:"2DUP",
+    0x6f:"3DUP", 0x70:"2OVER", 0x71:"2ROT", 0x72:"2SWAP", 0x73:"IFDUP", 0x74:"DEPTH", 0x75:"DROP",
+    0x76:"DUP", 0x77:"NIP", 0x78:"OVER", 0x79:"PICK", 0x7a:"ROLL", 0x7b:"ROT", 0x7c:"SWAP", 0x7d:"TUCK",
+    0x7e:"CAT", 0x7f:"SUBSTR", 0x80:"LEFT", 0x81:"RIGHT", 0x82:"SIZE", 0x83:"INVERT", 0x84:"AND",
+    0x85:"OR", 0x86:"XOR", 0x87:"EQUAL", 0x88:"EQUALVERIFY", 0x89:"RESERVED1", 0x8a:"RESERVED2",
+    0x8b:"1ADD", 0x8c:"1SUB", 0x8d:"2MUL", 0x8e:"2DIV", 0x8f:"NEGATE", 0x90:"ABS", 0x91:"NOT",
+    0x92:"0NOTEQUAL", 0x93:"ADD", 0x94:"SUB", 0x95:"MUL", 0x96:"DIV", 0x97:"MOD", 0x98:"LSHIFT",
+    0x99:"RSHIFT", 0x9a:"BOOLAND", 0x9b:"BOOLOR", 0x9c:"NUMEQUAL", 0x9d:"NUMEQUALVERIFY",
+    0x9e:"NUMNOTEQUAL", 0x9f:"LESSTHAN", 0xa0:"GREATERTHAN", 0xa1:"LESSTHANOREQUAL",
+    0xa2:"GREATERTHANOREQUAL", 0xa3:"MIN", 0xa4:"MAX", 0xa5:"WITHIN", 0xa6:"RIPEMD160", 0xa7:"SHA1",
+    0xa8:"SHA256", 0xa9:"HASH160", 0xaa:"HASH256", 0xab:"CODESEPARATOR", 0xac:"CHECKSIG",
+    0xad:"CHECKSIGVERIFY", 0xae:"CHECKMULTISIG", 0xaf:"CHECKMULTISIGVERIFY", 0xb0:"NOP1",
+    0xb1:"CHECKLOCKTIMEVERIFY", 0xb2:"CHECKSEQUENCEVERIFY",
+}
+for _ in range(1, 17):
+    OPNAMES[0x50+_] = str(_)
+for _ in range(0xb3, 0xba):
+    OPNAMES[_] = "NOP%d" % (_-0xb0+1)
+
+DISABLED = set([0x7e, 0x7f, 0x80, 0x81, 0x83, 0x84, 0x85, 0x86, 0x8d, 0x8e, 0x95, 0x96, 0x97, 0x98, 0x99])
+
+MAX_SCRIPT_SIZE = 10000
+MAX_ELEMENT_SIZE = 520
+MAX_OPS = 201
+MAX_STACK = 1000
+
+SIGVERSION_BASE = 0
+SIGVERSION_WITNESS_V0 = 1
+
+
+def decodenum(data, maxsize=4):
+    """ decode a script number: little endian, sign + magnitude """
+    if len(data) > maxsize:
+        raise ScriptError("number too large")
+    if not data:
+        return 0
+    n = int.from_bytes(data, "little")
+    if data[-1] & 0x80:
+        return -(n & ~(0x80 << 8*(len(data)-1)))
+    return n
+
+def encodenum(n):
+    """ encode a number as a minimal script number """
+    if n == 0:
+        return b""
+    a = abs(n)
+    data = bytearray()
+    while a:
+        data.append(a & 0xff)
+        a >>= 8
+    if data[-1] & 0x80:
+        data.append(0x80 if n<0 else 0)
+    elif n<0:
+        data[-1] |= 0x80
+    return bytes(data)
+
+def castbool(data):
+    for i, b in enumerate(data):
+        if b:
+            # negative zero is false
+            return not (i==len(data)-1 and b==0x80)
+    return False
+
+def pushencode(data):
+    """ the bytecode pushing 'data' """
+    n = len(data)
+    if n<=75:
+        return bytes([n]) + data
+    if n<=0xff:
+        return bytes([76, n]) + data
+    if n<=0xffff:
+        return bytes([77]) + n.to_bytes(2, "little") + data
+    return bytes([78]) + n.to_bytes(4, "little") + data
+
+def findanddelete(code, data):
+    """ remove all pushes of 'data' from the script, as done for legacy signature hashes """
+    pattern = pushencode(data)
+    res = []
+    pos = 0
+    for _, item, nextpos in iterops(code):
+        if code[pos:nextpos] != pattern:
+            res.append(code[pos:nextpos])
+        pos = nextpos
+    return b"".join(res)
+
+def removecodeseparators(code):
+    """ remove all OP_CODESEPARATORs, as done for the legacy signature hash scriptcode """
+    if b"\xab" not in code:
+        return code
+    res = []
+    pos = 0
+    for op, _, nextpos in iterops(code):
+        if op != 0xab:
+            res.append(code[pos:nextpos])
+        pos = nextpos
+    return b"".join(res)
+
+
+class SigCache:
+    """
+    A bounded cache of valid signatures, keyed by ( sighash, pubkey, signature ).
+    Failed verifications are not cached, so invalid signatures can not push out the valid ones.
+    The least recently used entries are dropped.
+    """
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        if key not in self.cache:
+            self.misses += 1
+            return False
+        self.cache.move_to_end(key)
+        self.hits += 1
+        return True
+
+    def add(self, key):
+        self.cache[key] = True
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+
+    def __len__(self):
+        return len(self.cache)
+
+
+class Context:
+    """ the input being verified """
+    def __init__(self, txn, inputindex, btcvalue, sigversion, legacy=None, sighashes=None):
+        self.txn = txn
+        self.inputindex = inputindex
+        self.btcvalue = btcvalue
+        self.sigversion = sigversion
+        self.legacy = legacy
+        self.sighashes = sighashes
+
+    def sighash(self, hashtype, scriptcode):
+        s = Script()
+        s.bytecode = scriptcode
+        if self.sigversion == SIGVERSION_WITNESS_V0:
+            if self.sighashes is None:
+                self.sighashes = SighashCache(self.txn)
+            return self.sighashes.witnesshash(self.inputindex, hashtype, self.btcvalue, s)
+        if self.legacy is None:
+            self.legacy = LegacySighash(self.txn)
+        s.bytecode = removecodeseparators(scriptcode)
+        return self.legacy.messagehash(self.inputindex, hashtype, s)
+
+
+class ScriptEngine:
+    """
+    Evaluates scripts, and verifies transaction inputs.
+
+    'opstats' contains for each opcode name: [ count, total seconds ]
+    """
+    def __init__(self, sigcache=None, curve=None, timing=True):
+        self.sigcache = sigcache if sigcache is not None else SigCache()
+        self.E = curve or myecdsa.secp256k1()
+        self.timing = timing
+        self.opstats = defaultdict(lambda: [0, 0.0])
+
+    def report(self):
+        """ return lines with the per opcode counters, most expensive first """
+        lines = []
+        for name, (count, total) in sorted(self.opstats.items(), key=lambda kv:-kv[1][1]):
+            lines.append("%-20s %10d %10.6f %12.3f us" % (name, count, total, 1e6*total/count))
+        lines.append("sigcache: %d entries, %d hits, %d misses" % (len(self.sigcache), self.sigcache.hits, self.sigcache.misses))
+        return lines
+
+    def checksig(self, sig, pubkey, scriptcode, ctx):
+        """ verify an ecdsa signature, the last byte of 'sig' is the hashtype """
+        if not sig:
+            return False
+        if ctx.sigversion == SIGVERSION_BASE:
+            scriptcode = findanddelete(scriptcode, sig)
+        return self.checkhash(ctx.sighash(sig[-1], scriptcode), pubkey, sig)
+
+    def checkhash(self, m, pubkey, sig):
+        """ verify 'sig' for message hash 'm', using the signature cache """
+        key = (m, pubkey, sig)
+        if key in self.sigcache:
+            return True
+        res = self.ecverify(m, pubkey, sig)
+        if res:
+            self.sigcache.add(key)
+        return res
+
+    def ecverify(self, m, pubkey, sig):
+        # note: PublicKey is imported here, to avoid loading all of BitcoinAddress when not verifying
+        from BitcoinAddress import PublicKey
+        try:
+            r, s, _ = decode_der(sig, strict=False)
+            pt = PublicKey.frompubkey(pubkey).point
+            return bool(self.E.verify(convert.numfrombytes(m), pt, r, s))
+        except Exception:
+            return False
+
+    def evaluate(self, code, stack, ctx):
+        """
+        Execute the script in 'code' on 'stack'. raises ScriptError when the script fails.
+        """
+        if len(code) > MAX_SCRIPT_SIZE:
+            raise ScriptError("script too large")
+        altstack = []
+        execstack = []
+        nfalse = 0      # number of non-executing branches in execstack
+        nops = 0
+        codesep = 0
+        stats = self.opstats
+        timing = self.timing
+
+        def countops(n):
+            nonlocal nops
+            nops += n
+            if nops > MAX_OPS:
+                raise ScriptError("too many operations")
+        def pop():
+            if not stack:
+                raise ScriptError("stack underflow")
+            return stack.pop()
+        def popnum():
+            return decodenum(pop())
+        def need(n):
+            if len(stack) < n:
+                raise ScriptError("stack underflow")
+
+        try:
+            ops = list(iterops(code))
+        except Exception as e:
+            raise ScriptError(str(e))
+
+        for op, data, nextpos in ops:
+            if timing:
+                t0 = time.perf_counter()
+            executing = nfalse == 0
+            if data is not None:
+                if len(data) > MAX_ELEMENT_SIZE:
+                    raise ScriptError("push too large")
+                if executing:
+                    stack.append(data)
+            else:
+                if op > 0x60:
+                    countops(1)
+                if op in DISABLED or op in (0x65, 0x66):
+                    raise ScriptError("disabled opcode %s" % OPNAMES[op])
+
+                if 0x63 <= op <= 0x68:
+                    # flow control is evaluated in non-executing branches as well
+                    if op in (0x63, 0x64):      # IF, NOTIF
+                        val = False
+                        if executing:
+                            val = castbool(pop())
+                            if op == 0x64:
+                                val = not val
+                        execstack.append(val)
+                        if not val:
+                            nfalse += 1
+                    elif op == 0x67:            # ELSE
+                        if not execstack:
+                            raise ScriptError("ELSE without IF")
+                        nfalse += 1 if execstack[-1] else -1
+                        execstack[-1] = not execstack[-1]
+                    elif op == 0x68:            # ENDIF
+                        if not execstack:
+                            raise ScriptError("ENDIF without IF")
+                        if not execstack.pop():
+                            nfalse -= 1
+                    elif executing:
+                        raise ScriptError("reserved opcode %s" % OPNAMES[op])
+                elif executing:
+                    codesep = self.execute(op, nextpos, codesep, code, stack, altstack, ctx, pop, popnum, need, countops)
+
+            if len(stack) + len(altstack) > MAX_STACK:
+                raise ScriptError("stack too large")
+            if timing:
+                name = OPNAMES.get(op, "PUSH") if data is None else "PUSH"
+                st = stats[name]
+                st[0] += 1
+                st[1] += time.perf_counter() - t0
+
+        if execstack:
+            raise ScriptError("unbalanced IF")
+
+    def execute(self, op, nextpos, codesep, code, stack, altstack, ctx, pop, popnum, need, countops):
+        """ execute a single non-push operation, returns the updated codeseparator position """
+        if 0x51 <= op <= 0x60:
+            stack.append(encodenum(op-0x50))
+        elif op == 0x4f:
+            stack.append(encodenum(-1))
+        elif op == 0x61 or op == 0xb0 or 0xb3 <= op <= 0xb9:
+            pass    # NOPs
+        elif op == 0x69:                # VERIFY
+            if not castbool(pop()):
+                raise ScriptError("VERIFY failed")
+        elif op == 0x6a:
+            raise ScriptError("OP_RETURN")
+        elif op == 0x6b:
+            altstack.append(pop())
+        elif op == 0x6c:
+            if not altstack:
+                raise ScriptError("altstack underflow")
+            stack.append(altstack.pop())
+        elif op == 0x6d:                # 2DROP
+            need(2)
+            del stack[-2:]
+        elif op == 0x6e:                # 2DUP
+            need(2)
+            stack.extend(stack[-2:])
+        elif op == 0x6f:                # 3DUP
+            need(3)
+            stack.extend(stack[-3:])
+        elif op == 0x70:                # 2OVER
+            need(4)
+            stack.extend(stack[-4:-2])
+        elif op == 0x71:                # 2ROT
+            need(6)
+            items = stack[-6:-4]
+            del stack[-6:-4]
+            stack.extend(items)
+        elif op == 0x72:                # 2SWAP
+            need(4)
+            stack[-4:] = stack[-2:] + stack[-4:-2]
+        elif op == 0x73:                # IFDUP
+            need(1)
+            if castbool(stack[-1]):
+                stack.append(stack[-1])
+        elif op == 0x74:                # DEPTH
+            stack.append(encodenum(len(stack)))
+        elif op == 0x75:
+            pop()
+        elif op == 0x76:                # DUP
+            need(1)
+            stack.append(stack[-1])
+        elif op == 0x77:                # NIP
+            need(2)
+            del stack[-2]
+        elif op == 0x78:                # OVER
+            need(2)
+            stack.append(stack[-2])
+        elif op in (0x79, 0x7a):        # PICK, ROLL
+            n = popnum()
+            if n < 0 or n >= len(stack):
+                raise ScriptError("invalid stack index")
+            item = stack[-n-1]
+            if op == 0x7a:
+                del stack[-n-1]
+            stack.append(item)
+        elif op == 0x7b:                # ROT
+            need(3)
+            stack.append(stack.pop(-3))
+        elif op == 0x7c:                # SWAP
+            need(2)
+            stack[-2], stack[-1] = stack[-1], stack[-2]
+        elif op == 0x7d:                # TUCK
+            need(2)
+            stack.insert(-2, stack[-1])
+        elif op == 0x82:                # SIZE
+            need(1)
+            stack.append(encodenum(len(stack[-1])))
+        elif op in (0x87, 0x88):        # EQUAL, EQUALVERIFY
+            a = pop()
+            b = pop()
+            if op == 0x88:
+                if a != b:
+                    raise ScriptError("EQUALVERIFY failed")
+            else:
+                stack.append(b"\x01" if a==b else b"")
+        elif 0x8b <= op <= 0x92:        # unary arithmetic
+            a = popnum()
+            if op == 0x8b: a += 1
+            elif op == 0x8c: a -= 1
+            elif op == 0x8f: a = -a
+            elif op == 0x90: a = abs(a)
+            elif op == 0x91: a = int(a == 0)
+            elif op == 0x92: a = int(a != 0)
+            stack.append(encodenum(a))
+        elif 0x93 <= op <= 0xa4:        # binary arithmetic
+            b = popnum()
+            a = popnum()
+            if op == 0x93: r = a + b
+            elif op == 0x94: r = a - b
+            elif op == 0x9a: r = int(a != 0 and b != 0)
+            elif op == 0x9b: r = int(a != 0 or b != 0)
+            elif op in (0x9c, 0x9d): r = int(a == b)
+            elif op == 0x9e: r = int(a != b)
+            elif op == 0x9f: r = int(a < b)
+            elif op == 0xa0: r = int(a > b)
+            elif op == 0xa1: r = int(a <= b)
+            elif op == 0xa2: r = int(a >= b)
+            elif op == 0xa3: r = min(a, b)
+            elif op == 0xa4: r = max(a, b)
+            if op == 0x9d:
+                if not r:
+                    raise ScriptError("NUMEQUALVERIFY failed")
+            else:
+                stack.append(encodenum(r))
+        elif op == 0xa5:                # WITHIN
+            hi = popnum()
+            lo = popnum()
+            x = popnum()
+            stack.append(encodenum(int(lo <= x < hi)))
+        elif op == 0xa6:
+            stack.append(ripemd160(pop()))
+        elif op == 0xa7:
+            stack.append(hashlib.sha1(pop()).digest())
+        elif op == 0xa8:
+            stack.append(sha256(pop()))
+        elif op == 0xa9:
+            stack.append(sharip(pop()))
+        elif op == 0xaa:
+            stack.append(shasha(pop()))
+        elif op == 0xab:                # CODESEPARATOR
+            codesep = nextpos
+        elif op in (0xac, 0xad):        # CHECKSIG, CHECKSIGVERIFY
+            pubkey = pop()
+            sig = pop()
+            ok = self.checksig(sig, pubkey, code[codesep:], ctx)
+            if op == 0xad:
+                if not ok:
+                    raise ScriptError("CHECKSIGVERIFY failed")
+            else:
+                stack.append(b"\x01" if ok else b"")
+        elif op in (0xae, 0xaf):        # CHECKMULTISIG, CHECKMULTISIGVERIFY
+            ok = self.checkmultisig(code[codesep:], ctx, pop, popnum, countops)
+            if op == 0xaf:
+                if not ok:
+                    raise ScriptError("CHECKMULTISIGVERIFY failed")
+            else:
+                stack.append(b"\x01" if ok else b"")
+        elif op == 0xb1:
+            self.checklocktime(decodenum(self.top(stack), 5), ctx)
+        elif op == 0xb2:
+            self.checksequence(decodenum(self.top(stack), 5), ctx)
+        else:
+            raise ScriptError("invalid opcode 0x%02x" % op)
+        return codesep
+
+    @staticmethod
+    def top(stack):
+        if not stack:
+            raise ScriptError("stack underflow")
+        return stack[-1]
+
+    def checkmultisig(self, scriptcode, ctx, pop, popnum, countops):
+        nkeys = popnum()
+        if not 0 <= nkeys <= 20:
+            raise ScriptError("invalid number of keys")
+        # each key counts as an operation
+        countops(nkeys)
+        keys = [ pop() for _ in range(nkeys) ][::-1]
+        nsigs = popnum()
+        if not 0 <= nsigs <= nkeys:
+            raise ScriptError("invalid number of signatures")
+        sigs = [ pop() for _ in range(nsigs) ][::-1]
+        pop()       # the extra item consumed because of the off-by-one bug
+
+        if ctx.sigversion == SIGVERSION_BASE:
+            for sig in sigs:
+                scriptcode = findanddelete(scriptcode, sig)
+
+        # signatures must match the keys in order.
+        # the message hash only depends on the signature's hashtype, not on the key.
+        ikey = 0
+        for sig in sigs:
+            if not sig:
+                return False
+            m = ctx.sighash(sig[-1], scriptcode)
+            while ikey < len(keys) and not self.checkhash(m, keys[ikey], sig):
+                ikey += 1
+            if ikey == len(keys):
+                return False
+            ikey += 1
+        return True
+
+    @staticmethod
+    def checklocktime(locktime, ctx):
+        """ bip65 """
+        txn = ctx.txn
+        if locktime < 0:
+            raise ScriptError("negative locktime")
+        if (locktime < 500000000) != (txn.locktime < 500000000):
+            raise ScriptError("locktime type mismatch")
+        if locktime > txn.locktime:
+            raise ScriptError("locktime not reached")
+        if txn.inputs[ctx.inputindex].sequence_number == 0xffffffff:
+            raise ScriptError("input is final")
+
+    @staticmethod
+    def checksequence(sequence, ctx):
+        """ bip112 """
+        if sequence < 0:
+            raise ScriptError("negative sequence")
+        if sequence & (1<<31):
+            return
+        txn = ctx.txn
+        txseq = txn.inputs[ctx.inputindex].sequence_number
+        if txn.version < 2 or txseq & (1<<31):
+            raise ScriptError("sequence lock disabled")
+        mask = (1<<22) | 0xffff
+        if (sequence & (1<<22)) != (txseq & (1<<22)):
+            raise ScriptError("sequence type mismatch")
+        if (sequence & mask) > (txseq & mask):
+            raise ScriptError("sequence not reached")
+
+    def verify_input(self, txn, inputindex, prevout, legacy=None, sighashes=None):
+        """
+        Verify that input 'inputindex' of 'txn' can spend 'prevout', an `Output` object.
+        Raises ScriptError when the scripts fail.
+        """
+        inp = txn.inputs[inputindex]
+        scriptsig = inp.script.bytecode
+        scriptpubkey = prevout.script.bytecode
+        ctx = Context(txn, inputindex, prevout.btcvalue, SIGVERSION_BASE, legacy, sighashes)
+
+        stack = []
+        self.evaluate(scriptsig, stack, ctx)
+        p2shstack = list(stack)
+        self.evaluate(scriptpubkey, stack, ctx)
+        if not stack or not castbool(stack[-1]):
+            raise ScriptError("script evaluated to false")
+
+        program = scriptpubkey
+        t, value = classify_bytecode(scriptpubkey)
+        if t == "p2sh":
+            if not p2shstack or any(op > 0x60 for op, _, _ in iterops(scriptsig)):
+                raise ScriptError("p2sh scriptsig must be push only")
+            program = p2shstack.pop()
+            stack = p2shstack
+            self.evaluate(program, stack, ctx)
+            if not stack or not castbool(stack[-1]):
+                raise ScriptError("p2sh script evaluated to false")
+            t, value = classify_bytecode(program)
+            if t in ("p2wpkh", "p2wsh", "p2tr", "witness") and scriptsig != pushencode(program):
+                raise ScriptError("p2sh witness scriptsig must push only the redeemscript")
+        elif t in ("p2wpkh", "p2wsh", "p2tr", "witness") and scriptsig:
+            raise ScriptError("witness input must have an empty scriptsig")
+
+        if t in ("p2wpkh", "p2wsh", "p2tr", "witness"):
+            witness = txn.witness[inputindex].wstruct if txn.witness else []
+            self.verify_witness(t, value, witness, ctx)
+
+        return True
+
+    def verify_witness(self, t, program, witness, ctx):
+        ctx.sigversion = SIGVERSION_WITNESS_V0
+        if t == "p2wpkh":
+            if len(witness) != 2:
+                raise ScriptError("p2wpkh needs 2 witness items")
+            script = b"\x76\xa9\x14" + program + b"\x88\xac"
+            stack = list(witness)
+        elif t == "p2wsh":
+            if not witness:
+                raise ScriptError("empty p2wsh witness")
+            script = witness[-1]
+            if sha256(script) != program:
+                raise ScriptError("witness script hash mismatch")
+            stack = list(witness[:-1])
+        elif t == "p2tr":
+            raise ScriptError("taproot spends are not supported")
+        else:
+            version, _ = program
+            if version == 0:
+                raise ScriptError("invalid witness v0 program length")
+            # the witness versions 1 .. 16 without a defined program are anyone-can-spend.
+            return
+        if any(len(item) > MAX_ELEMENT_SIZE for item in stack):
+            raise ScriptError("witness item too large")
+        self.evaluate(script, stack, ctx)
+        if len(stack) != 1 or not castbool(stack[0]):
+            raise ScriptError("witness script evaluated to false")
+
+    def verify_transaction(self, txn, prevouts):
+        """
+        Verify all inputs of 'txn', 'prevouts' is the list of spent outputs.
+        Returns a list with for each input True, or the ScriptError message.
+        """
+        legacy = LegacySighash(txn)
+        sighashes = SighashCache(txn, prevouts)
+        results = []
+        for i, prevout in enumerate(prevouts):
+            try:
+                results.append(self.verify_input(txn, i, prevout, legacy, sighashes))
+            except ScriptError as e:
+                results.append(str(e))
+        return results
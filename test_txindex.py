@@ -0,0 +1,76 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+from io import BytesIO
+
+from bcdataio import Writer
+from txndecoder import Transaction, Input, Output, Script
+from txindex import TxIndex
+
+def maketransaction(n):
+    txn = Transaction()
+    txn.version = 1
+    txn.locktime = n
+    txn.witness = None
+    inp = Input()
+    inp.txn_hash = struct.pack("<L", n) * 8
+    inp.output_index = 0
+    inp.script = Script()
+    inp.sequence_number = 0xffffffff
+    out = Output()
+    out.btcvalue = n
+    out.script = Script()
+    out.script.bytecode = b"\x6a"
+    txn.inputs = [inp]
+    txn.outputs = [out]
+    return txn
+
+def encode(txn):
+    bio = BytesIO()
+    txn.encode(Writer(bio))
+    return bio.getvalue()
+
+class TestTxIndex(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.index = os.path.join(self.dir, "txindex.bin")
+        self.transactions = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def addblock(self, fileno):
+        """ append a regtest block with two new transactions to blk<fileno>.dat """
+        txns = [ maketransaction(len(self.transactions) + i) for i in range(2) ]
+        self.transactions.extend(txns)
+        body = struct.pack("<L32s32sLLL", 1, bytes(32), bytes(32), 0, 0x207fffff, 0) + bytes([len(txns)]) + b"".join(encode(t) for t in txns)
+        with open(os.path.join(self.dir, "blk%05d.dat" % fileno), "ab") as fh:
+            fh.write(b"\xfa\xbf\xb5\xda" + struct.pack("<L", len(body)) + body)
+
+    def checkall(self, idx):
+        for txn in self.transactions:
+            self.assertEqual(idx.gettransaction(txn.txid()), encode(txn))
+
+    def test_grow_and_add_file(self):
+        self.addblock(0)
+        self.addblock(1)
+        idx = TxIndex(self.index)
+        self.assertEqual(idx.update([self.dir]), 4)
+
+        # grow an indexed file, and add a new one in the same update.
+        self.addblock(1)
+        self.addblock(2)
+        self.assertEqual(idx.update([self.dir]), 4)
+        self.assertEqual([ os.path.basename(name) for name, _ in idx.files ], ["blk00000.dat", "blk00001.dat", "blk00002.dat"])
+        self.checkall(idx)
+        idx.close()
+
+        idx = TxIndex(self.index)
+        self.checkall(idx)
+        self.assertEqual(idx.update([self.dir]), 0)
+        idx.close()
+
+if __name__ == '__main__':
+    unittest.main()
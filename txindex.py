@@ -0,0 +1,279 @@
+"""
+A persistent index of transaction locations in bitcoin core's blk*.dat files:
+    txid -> ( blockfile, offset, length )
+
+The index is a single binary file, consisting of a header followed by segments:
+    header:     "TXIX"  <L version>  <L nsegments>  <Q end of the last segment>
+    segment:    "TXSG"  <L nfiles>  <Q nrecords>
+        files:      the files added or grown by this segment, each:
+                        <L fileno>  <H namelen>  <name>  <Q indexed size>
+        records:    sorted by txid, each:  <32 byte txid>  <L fileno>  <L offset>  <L length>
+
+The records are fixed size, and sorted, so a lookup is a binary search in each
+segment of the mmapped file. When block files are added, or have grown, only the
+new blocks are decoded, and their records are appended as a new segment, followed
+by updating the header. When there are more than MAXSEGMENTS segments, they are
+merged into one.
+
+Transactions are decoded directly from the mmapped block files.
+
+usage:
+    python3 txindex.py --index txindex.bin ~/.bitcoin/blocks
+    python3 txindex.py --index txindex.bin <txid>
+"""
+from __future__ import print_function, division
+import heapq
+import mmap
+import os
+import struct
+
+import blockfile
+from bcdataio import BufferReader
+from txndecoder import Transaction
+
+MAGIC = b"TXIX"
+HEADER = struct.Struct("<4sLLQ")
+SEGMAGIC = b"TXSG"
+SEGHEADER = struct.Struct("<4sLQ")
+RECORD = struct.Struct("<32sLLL")
+MAXSEGMENTS = 8
+
+class TxIndex:
+    def __init__(self, filename):
+        self.filename = filename
+        self.files = []         # list of [ name, indexed size ]
+        self.segments = []      # list of ( records offset, nrecords )
+        self.nrecords = 0
+        self.end = HEADER.size
+        self.fh = None
+        self.mm = None
+        self.blockmaps = dict()
+        if os.path.exists(filename):
+            self.load()
+
+    def load(self):
+        self.close()
+        self.fh = open(self.filename, "rb")
+        magic, version, nsegments, self.end = HEADER.unpack(self.fh.read(HEADER.size))
+        if magic != MAGIC or version != 2:
+            raise Exception("not a txindex file")
+        self.files = []
+        self.segments = []
+        for _ in range(nsegments):
+            magic, nfiles, nrecords = SEGHEADER.unpack(self.fh.read(SEGHEADER.size))
+            if magic != SEGMAGIC:
+                raise Exception("invalid txindex segment")
+            for _ in range(nfiles):
+                fileno, namelen = struct.unpack("<LH", self.fh.read(6))
+                name = self.fh.read(namelen).decode('utf-8')
+                size, = struct.unpack("<Q", self.fh.read(8))
+                if fileno == len(self.files):
+                    self.files.append([name, size])
+                else:
+                    self.files[fileno][1] = size
+            self.segments.append((self.fh.tell(), nrecords))
+            self.fh.seek(nrecords*RECORD.size, os.SEEK_CUR)
+        self.nrecords = sum(n for _, n in self.segments)
+        if self.nrecords:
+            self.mm = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        if self.mm:
+            self.mm.close()
+            self.mm = None
+        if self.fh:
+            self.fh.close()
+            self.fh = None
+        for fh, mm in self.blockmaps.values():
+            mm.close()
+            fh.close()
+        self.blockmaps = dict()
+
+    def lookup(self, txid):
+        """ return ( filename, offset, length ) for 'txid' in internal byte order, or None """
+        if not self.nrecords:
+            return
+        mm = self.mm
+        # search the newest segment first
+        for base, nrecords in reversed(self.segments):
+            lo, hi = 0, nrecords
+            while lo < hi:
+                mid = (lo+hi)//2
+                o = base + mid*RECORD.size
+                key = mm[o:o+32]
+                if key < txid:
+                    lo = mid+1
+                elif key > txid:
+                    hi = mid
+                else:
+                    _, fileno, offset, length = RECORD.unpack_from(mm, o)
+                    return self.files[fileno][0], offset, length
+
+    def blockmap(self, name, end):
+        """ return a mmap of block file 'name', covering at least 'end' bytes """
+        bm = self.blockmaps.get(name)
+        if bm and len(bm[1]) < end:
+            # the block file has grown since it was mapped
+            bm[1].close()
+            bm[0].close()
+            bm = None
+        if not bm:
+            fh = open(name, "rb")
+            bm = self.blockmaps[name] = fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        return bm[1]
+
+    def gettransaction(self, txid):
+        """ return the raw transaction data, or None """
+        loc = self.lookup(txid)
+        if not loc:
+            return
+        name, offset, length = loc
+        return self.blockmap(name, offset+length)[offset:offset+length]
+
+    def loadtransaction(self, txid):
+        """ return the decoded transaction, or None """
+        loc = self.lookup(txid)
+        if not loc:
+            return
+        name, offset, length = loc
+        mm = self.blockmap(name, offset+length)
+        return BufferReader(mm, offset, offset+length).readobject(Transaction)
+
+    def scan(self, fileno, name, start):
+        """ return the records for all blocks from offset 'start', and the new indexed size """
+        records = []
+        end = start
+        with open(name, "rb") as fh:
+            for pos, data in blockfile.iterblocks(fh, start):
+                blk = blockfile.Block.frombytes(data)
+                for (s, e), txid in zip(blk.txnspans, blk.txids()):
+                    records.append(RECORD.pack(txid, fileno, pos+s, e-s))
+                end = pos + len(data)
+        return records, end
+
+    def update(self, paths, verbose=False):
+        """
+        add new block files, and new blocks in files which have grown.
+        Returns the number of transactions added.
+        """
+        known = dict((name, i) for i, (name, _) in enumerate(self.files))
+        changed = []            # list of ( fileno, name, indexed size )
+        newrecords = []
+        nnew = 0                # the number of new files, these are numbered after the known files
+        seen = set()
+        for path in paths:
+            for name in blockfile.blockfiles(path):
+                name = os.path.abspath(name)
+                if name in seen:
+                    continue
+                seen.add(name)
+                fileno = known.get(name)
+                if fileno is None:
+                    fileno = len(self.files) + nnew
+                    indexed = 0
+                else:
+                    indexed = self.files[fileno][1]
+                if os.path.getsize(name) <= indexed:
+                    continue
+                if verbose:
+                    print("indexing %s" % name)
+                records, size = self.scan(fileno, name, indexed)
+                if size > indexed:
+                    if name not in known:
+                        # only files with blocks get a number, so the numbers have no gaps.
+                        nnew += 1
+                    changed.append((fileno, name, size))
+                newrecords.extend(records)
+
+        if not changed:
+            return 0
+        newrecords.sort()
+        self.append(changed, newrecords)
+        if len(self.segments) > MAXSEGMENTS:
+            self.compact()
+        return len(newrecords)
+
+    @staticmethod
+    def packsegment(files, nrecords):
+        """ the header and file table of a segment, 'files' is a list of ( fileno, name, size ) """
+        data = [ SEGHEADER.pack(SEGMAGIC, len(files), nrecords) ]
+        for fileno, name, size in files:
+            name = name.encode('utf-8')
+            data.append(struct.pack("<LH", fileno, len(name)) + name + struct.pack("<Q", size))
+        return b"".join(data)
+
+    def append(self, files, newrecords):
+        """ append a segment with the sorted 'newrecords' """
+        if not os.path.exists(self.filename):
+            with open(self.filename, "wb") as fh:
+                fh.write(HEADER.pack(MAGIC, 2, 0, HEADER.size))
+        nsegments = len(self.segments)
+        end = self.end
+        self.close()
+        with open(self.filename, "r+b") as fh:
+            # anything after the last segment is left from an interrupted update
+            fh.seek(end)
+            fh.write(self.packsegment(files, len(newrecords)))
+            fh.write(b"".join(newrecords))
+            end = fh.tell()
+            fh.truncate()
+            fh.flush()
+            os.fsync(fh.fileno())
+            # the new segment becomes part of the index when the header is written
+            fh.seek(0)
+            fh.write(HEADER.pack(MAGIC, 2, nsegments+1, end))
+        self.load()
+
+    def segmentrecords(self, base, nrecords):
+        for i in range(nrecords):
+            o = base + i*RECORD.size
+            yield self.mm[o:o+RECORD.size]
+
+    def compact(self):
+        """ merge all segments into one """
+        if len(self.segments) <= 1:
+            return
+        files = [ (i, name, size) for i, (name, size) in enumerate(self.files) ]
+        segment = self.packsegment(files, self.nrecords)
+        records = [ self.segmentrecords(base, nrecords) for base, nrecords in self.segments ]
+
+        tmpname = self.filename + ".tmp"
+        with open(tmpname, "wb") as fh:
+            fh.write(HEADER.pack(MAGIC, 2, 1, HEADER.size + len(segment) + self.nrecords*RECORD.size))
+            fh.write(segment)
+            for rec in heapq.merge(*records):
+                fh.write(rec)
+        self.close()
+        os.replace(tmpname, self.filename)
+        self.load()
+
+
+def main():
+    import argparse
+    from binascii import a2b_hex
+    parser = argparse.ArgumentParser(description='build or query a txid to blockfile index')
+    parser.add_argument('--index', type=str, required=True, help='the index file')
+    parser.add_argument('--verbose', '-v', action='store_true')
+    parser.add_argument('--compact', action='store_true', help='merge the index segments into one')
+    parser.add_argument('ARGS', nargs='*', type=str, help='block files or directories to index, or txids to lookup')
+    args = parser.parse_args()
+
+    idx = TxIndex(args.index)
+    paths = [ a for a in args.ARGS if os.path.exists(a) ]
+    if paths:
+        n = idx.update(paths, args.verbose)
+        print("added %d transactions" % n)
+    if args.compact:
+        idx.compact()
+
+    for a in args.ARGS:
+        if a in paths:
+            continue
+        data = idx.gettransaction(a2b_hex(a)[::-1])
+        if data:
+            print(data.hex())
+        else:
+            print("%s not found" % a)
+
+if __name__ == '__main__':
+    main()
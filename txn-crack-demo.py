@@ -9,7 +9,7 @@ from myecdsa import secp256k1
 from hashing import shasha, sharip
 from bcdataio import Reader, Writer
 from txndecoder import Transaction, Script
-from bcsigutils import decode_signature, messagehash, witnesshash 
+from bcsigutils import decode_signature, LegacySighash, SighashCache
 
 from convert import numfrombytes as tonum
 from BitcoinAddress import PublicKey
@@ -121,6 +121,8 @@ def main():
     import argparse
     parser = argparse.ArgumentParser(description='transaction cracker')
     parser.add_argument('--verbose', '-v', action='store_true')
+    parser.add_argument('--prevouts', type=str, help='prevout index database, see prevoutindex.py')
+    parser.add_argument('--txindex', type=str, help='transaction location index, see txindex.py')
     parser.add_argument('ARGS',  nargs='*', type=str)
     args = parser.parse_args()
 
@@ -132,9 +134,16 @@ def main():
             if l and l[0]!='-':
                 transactions.append(unhex(l))
     else:
+        txindex = None
+        if args.txindex:
+            from txindex import TxIndex
+            txindex = TxIndex(args.txindex)
         for a in args.ARGS:
             if len(a)==64:
-                transactions.append(blockchairapi.gettransaction(unhex(a)))
+                txndata = txindex and txindex.gettransaction(unhex(a)[::-1])
+                if not txndata:
+                    txndata = blockchairapi.gettransaction(unhex(a))
+                transactions.append(txndata)
             else:
                 transactions.append(unhex(a))
 
@@ -142,10 +151,17 @@ def main():
 
     txnbyhash = dict()
 
+    prevouts = None
+    if args.prevouts:
+        from prevoutindex import PrevoutIndex
+        prevouts = PrevoutIndex(args.prevouts)
+
     def lookupoutput(txnhash, outputindex):
         t = txnbyhash.get(txnhash)
         if t:
             return t.outputs[outputindex]
+        if prevouts is not None:
+            return prevouts.lookup(txnhash, outputindex)
 
     # for make index of all transactions
     for txndata in transactions:
@@ -161,6 +177,8 @@ def main():
             print("txn: ", b2a_hex(calctxnhash(txn)))
             print(" - %s" % b2a_hex(txndata))
 
+        sighashes = SighashCache(txn)
+        legacyhashes = LegacySighash(txn)
         for i, inp in enumerate(txn.inputs):
             pubs = set()
             sigs = set()
@@ -183,13 +201,13 @@ def main():
 
             out = lookupoutput(inp.txn_hash, inp.output_index)
             for pub in pubs:
-                if txn.witness:
+                if txn.witness and txn.witness[i].wstruct:
                     if not out:
                         # can't calculate the witnesshash without the btcvalue.
                         if args.verbose:
                             print("missing btcvalue for input %s:%d" % (b2a_hex(inp.txn_hash), inp.output_index))
                         continue
-                    m = witnesshash(txn, i, out.btcvalue)
+                    msghash = lambda hashtype: sighashes.witnesshash(i, hashtype, out.btcvalue, scriptpubkey=out.script)
                 else:
                     if not out:
                         # we can invent a probable output script
@@ -197,16 +215,19 @@ def main():
                     else:
                         outscr = out.script
 
-                    # TODO - backport changes here.
-                    m = messagehash(txn, 1, i, outscr)
+                    msghash = lambda hashtype: legacyhashes.messagehash(i, hashtype, outscr)
 
+                # the message hash depends on the hashtype of each signature.
+                hashes = dict()
                 for sig in sigs:
                     ci = CrackInfo()
                     ci.srctxn = inp.txn_hash
                     ci.srcindex = inp.output_index
                     ci.pubkey = pub
-                    ci.r, ci.s = sig
-                    ci.m = m
+                    ci.r, ci.s, hashtype = sig
+                    if hashtype not in hashes:
+                        hashes[hashtype] = msghash(hashtype)
+                    ci.m = hashes[hashtype]
 
                     crackdata.append(ci)
                     if args.verbose:
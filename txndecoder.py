@@ -1,13 +1,29 @@
-""" handle decoding and encoding of transactions """
-from bcdataio import Reader
+"""
+handle decoding and encoding of transactions
+
+All classes use __slots__, to keep the memory use of large numbers of
+decoded transactions low.
+
+Script objects, and the bytes they contain, are treated as immutable values:
+code which needs a different script assigns a new Script object, and never
+modifies the bytecode of an existing script. So copies of transactions,
+inputs and outputs can share their scripts.
+"""
+from collections import Counter
+from bcdataio import Reader, Writer, varintsize
 from io import BytesIO
-from hashing import shasha, sharip
+from hashing import shasha, sharip, taggedhash
 
 class Input:
-    """ encode, decode a transaction input """
+    """
+    encode, decode a transaction input
+
+    The outpoint is stored as a ( txn_hash, output_index ) tuple.
+    """
+    __slots__ = ("outpoint", "script", "sequence_number")
+
     def decode(self, r):
-        self.txn_hash = r.readbytes(32)
-        self.output_index = r.readdword()
+        self.outpoint = (r.readbytes(32), r.readdword())
         self.script = r.readobject(Script)
         self.sequence_number = r.readdword()
     def encode(self, w):
@@ -15,10 +31,27 @@ class Input:
         w.writedword(self.output_index)
         self.script.encode(w)
         w.writedword(self.sequence_number)
+
+    @property
+    def txn_hash(self):
+        return self.outpoint[0]
+    @txn_hash.setter
+    def txn_hash(self, value):
+        self.outpoint = (value, getattr(self, "outpoint", (None, None))[1])
+
+    @property
+    def output_index(self):
+        return self.outpoint[1]
+    @output_index.setter
+    def output_index(self, value):
+        self.outpoint = (getattr(self, "outpoint", (None, None))[0], value)
+
+    def size(self):
+        return 40 + self.script.size()
+
     def copy(self):
         inp = Input()
-        inp.txn_hash = self.txn_hash
-        inp.output_index = self.output_index 
+        inp.outpoint = self.outpoint
         inp.script = self.script
         inp.sequence_number = self.sequence_number
         return inp
@@ -26,15 +59,27 @@ class Input:
 
 class Output:
     """ encode, decode a transaction output """
+    __slots__ = ("btcvalue", "script")
+
     def decode(self, r):
         self.btcvalue = r.readqword()
         self.script = r.readobject(Script)
     def encode(self, w):
         w.writeqword(self.btcvalue)
         self.script.encode(w)
+    def size(self):
+        return 8 + self.script.size()
+
+    def copy(self):
+        out = Output()
+        out.btcvalue = self.btcvalue
+        out.script = self.script
+        return out
 
 class Witness:
-    """ encode, decode a transaction output """
+    """ encode, decode the witness of a transaction input """
+    __slots__ = ("wstruct",)
+
     def decode(self, r):
         nr = r.readvarint()
         self.wstruct = []
@@ -47,19 +92,81 @@ class Witness:
             w.writevarint(len(item))
             w.writebytes(item)
 
-    def gettype(self):
-        if len(self.wstruct)==2:
+    def size(self):
+        return varintsize(len(self.wstruct)) + sum(varintsize(len(item)) + len(item) for item in self.wstruct)
+
+    def annex(self):
+        """ return the taproot annex, or None """
+        if len(self.wstruct)>=2 and self.wstruct[-1][:1]==b"\x50":
+            return self.wstruct[-1]
+
+    def taprootstack(self):
+        """ the witness items, without the annex """
+        if self.annex() is not None:
+            return self.wstruct[:-1]
+        return self.wstruct
+
+    def gettype(self, scriptpubkey=None):
+        """
+        Determine the kind of witness: p2wpkh, p2wsh, p2tr ( key path ), or p2tr-script.
+
+        When the script of the spent output is known, the type is taken from that,
+        for a p2sh wrapped witness, pass the redeemscript.
+        Otherwise the type is guessed from the witness items.
+        """
+        if scriptpubkey is not None:
+            code = scriptpubkey.bytecode
+            if len(code)==22 and code[:2]==b"\x00\x14":
+                return "p2wpkh"
+            if len(code)==34 and code[:2]==b"\x00\x20":
+                return "p2wsh"
+            if len(code)==34 and code[:2]==b"\x51\x20":
+                return "p2tr" if len(self.taprootstack())==1 else "p2tr-script"
+            # otherwise: p2sh wrapped, guess from the witness
+
+        if len(self.wstruct)==2 and len(self.wstruct[1])==33 and self.wstruct[1][0] in (2,3):
             return "p2wpkh"
+        items = self.taprootstack()
+        if len(items)==1 and len(items[0]) in (64, 65):
+            return "p2tr"
+        if len(items)>=2 and self.iscontrolblock(items[-1]):
+            return "p2tr-script"
         return "p2wsh"
 
-    def encode_scriptcode(self, w):
-        t = self.gettype()
+    @staticmethod
+    def iscontrolblock(data):
+        """ check if data looks like a taproot control block """
+        return len(data)>=33 and (len(data)-33)%32==0 and len(data)<=33+128*32 and (data[0]&0xfe)==0xc0
+
+    def witnessscript(self):
+        """ the script of a p2wsh spend """
+        return self.wstruct[-1]
+
+    def tapscript(self):
+        """ the leaf script of a taproot script path spend """
+        return self.taprootstack()[-2]
+
+    def controlblock(self):
+        return self.taprootstack()[-1]
+
+    def tapleafhash(self):
+        """ the bip341 leaf hash of a taproot script path spend """
+        script = self.tapscript()
+        bio = BytesIO()
+        w = Writer(bio)
+        w.writebyte(self.controlblock()[0]&0xfe)  # leaf version
+        w.writevarint(len(script))
+        w.writebytes(script)
+        return taggedhash("TapLeaf", bio.getvalue())
+
+    def encode_scriptcode(self, w, scriptpubkey=None):
+        t = self.gettype(scriptpubkey)
         if t == "p2wpkh":
             self.p2wpkh_scriptcode(w)
         elif t == "p2wsh":
             self.p2wsh_scriptcode(w)
         else:
-            raise Exception("not implemented")
+            raise Exception("no scriptcode for %s" % t)
 
     def p2wpkh_scriptcode(self, w):
         w.writebyte(0x19)
@@ -71,10 +178,19 @@ class Witness:
         w.writebyte(0xac)
 
     def p2wsh_scriptcode(self, w):
-        pass  # TODO
+        """
+        note: when the script executes an OP_CODESEPARATOR, the scriptcode
+        should only contain the part after the last executed separator.
+        This writes the entire witness script.
+        """
+        script = self.witnessscript()
+        w.writevarint(len(script))
+        w.writebytes(script)
 
 class Script:
     """ encode, decode a transaction script """
+    __slots__ = ("bytecode",)
+
     def __init__(self):
         self.bytecode = b''
     def decode(self, r):
@@ -84,6 +200,33 @@ class Script:
         w.writevarint(len(self.bytecode))
         w.writebytes(self.bytecode)
 
+    def size(self):
+        """ the size of the encoded script, including the length """
+        return varintsize(len(self.bytecode)) + len(self.bytecode)
+
+    def sigopcount(self, accurate=False):
+        """
+        count the signature operations in the script.
+        With 'accurate', a CHECKMULTISIG preceded by OP_1 .. OP_16 counts as that number,
+        otherwise it counts as 20.
+        """
+        n = 0
+        prev = None
+        try:
+            for op, data, _ in iterops(self.bytecode):
+                if op in (0xac, 0xad):
+                    n += 1
+                elif op in (0xae, 0xaf):
+                    if accurate and prev is not None and 0x51 <= prev <= 0x60:
+                        n += prev - 0x50
+                    else:
+                        n += 20
+                prev = op
+        except Exception:
+            # like bitcoin core: count up to the invalid push
+            pass
+        return n
+
     def __iter__(self):
         """ enumerate all items in the script's bytecode """
         r = Reader(BytesIO(self.bytecode))
@@ -107,10 +250,226 @@ class Script:
             else:
                 yield 'opcode', b
 
+    def classify(self):
+        """
+        Determine the type of an output script, returns a tuple: ( type, value ).
+        See `classify_bytecode`.
+        """
+        return classify_bytecode(self.bytecode)
+
+    def classify_input(self):
+        """
+        Determine the type of an input script, returns a tuple: ( type, value ).
+
+        types:
+            empty           - no value, a native segwit input
+            p2pk            - the signature
+            p2pkh           - ( signature, pubkey )
+            multisig        - list of signatures
+            p2sh-p2wpkh,
+            p2sh-p2wsh      - the redeemscript
+            p2sh            - ( list of pushed items, redeemscript )
+            nonstandard     - None
+        """
+        items = pushed_items(self.bytecode)
+        if items is None:
+            return "nonstandard", None
+        if not items:
+            return "empty", None
+        last = items[-1]
+        if len(items)==1:
+            if len(last)==22 and last[:2]==b"\x00\x14":
+                return "p2sh-p2wpkh", last
+            if len(last)==34 and last[:2]==b"\x00\x20":
+                return "p2sh-p2wsh", last
+            if last[:1]==b"\x30":
+                return "p2pk", last
+        if len(items)==2 and len(last) in (33, 65) and last[0] in (2,3,4) and items[0][:1]==b"\x30":
+            return "p2pkh", tuple(items)
+        if items[0]==b"" and all(_[:1]==b"\x30" for _ in items[1:]):
+            return "multisig", items[1:]
+        if last:
+            return "p2sh", (items[:-1], last)
+        return "nonstandard", None
+
+
+def iterops(code):
+    """
+    enumerate the operations in a script's bytecode.
+    yields tuples: ( opcode, pushed data or None, offset of the next operation )
+    """
+    i = 0
+    n = len(code)
+    while i < n:
+        b = code[i]
+        i += 1
+        if b<=78:
+            if b<=75:
+                size = b
+            else:
+                nsize = 1 << (b-76)
+                if i+nsize > n:
+                    raise Exception("truncated script")
+                size = int.from_bytes(code[i:i+nsize], "little")
+                i += nsize
+            if i+size > n:
+                raise Exception("truncated script")
+            yield b, code[i:i+size], i+size
+            i += size
+        else:
+            yield b, None, i
+
+def pushed_items(code):
+    """
+    return the list of items pushed by a push-only script,
+    or None when the script contains other opcodes.
+    OP_1NEGATE and OP_1 .. OP_16 push their value as a script number.
+    """
+    items = []
+    try:
+        for op, data, _ in iterops(code):
+            if data is None:
+                if 0x51 <= op <= 0x60:
+                    data = bytes([op-0x50])
+                elif op == 0x4f:
+                    data = b"\x81"
+                else:
+                    return
+            items.append(data)
+    except Exception:
+        return
+    return items
+
+def _classify_multisig(code):
+    m = code[0]-80
+    n = code[-2]-80
+    if not (1<=m<=n<=16):
+        return
+    keys = []
+    i = 1
+    end = len(code)-2
+    while i < end:
+        size = code[i]
+        if size not in (33, 65) or i+1+size > end:
+            return
+        keys.append(code[i+1:i+1+size])
+        i += 1+size
+    if len(keys)!=n:
+        return
+    return m, keys
+
+def classify_bytecode(code):
+    """
+    Determine the type of an output script, by matching the script template.
+    returns a tuple: ( type, value ).
+
+    types:
+        p2pk        - the pubkey
+        p2pkh, p2sh, p2wpkh, p2wsh, p2tr   - the hash, or taproot key
+        witness     - ( version, program ) for other witness versions
+        multisig    - ( m, list of pubkeys )
+        nulldata    - the bytes following OP_RETURN
+        nonstandard - None
+    """
+    n = len(code)
+    if n==25:
+        if code[:3]==b"\x76\xa9\x14" and code[23:]==b"\x88\xac":
+            return "p2pkh", code[3:23]
+    elif n==23:
+        if code[:2]==b"\xa9\x14" and code[22]==0x87:
+            return "p2sh", code[2:22]
+    elif n==22:
+        if code[:2]==b"\x00\x14":
+            return "p2wpkh", code[2:]
+    elif n==34:
+        if code[:2]==b"\x00\x20":
+            return "p2wsh", code[2:]
+        if code[:2]==b"\x51\x20":
+            return "p2tr", code[2:]
+    elif n==35:
+        if code[0]==0x21 and code[34]==0xac:
+            return "p2pk", code[1:34]
+    elif n==67:
+        if code[0]==0x41 and code[66]==0xac:
+            return "p2pk", code[1:66]
+    if n and code[0]==0x6a:
+        return "nulldata", code[1:]
+    if 4<=n<=42 and code[1]+2==n and 2<=code[1]<=40 and (code[0]==0 or 0x51<=code[0]<=0x60):
+        return "witness", (code[0] and code[0]-80, code[2:])
+    if n>=37 and code[-1]==0xae:
+        ms = _classify_multisig(code)
+        if ms:
+            return "multisig", ms
+    return "nonstandard", None
+
+# the fixed templates: ( type, length, prefix, suffix ), the value is the part between prefix and suffix.
+SCRIPT_TEMPLATES = [
+    ("p2pkh",  25, b"\x76\xa9\x14", b"\x88\xac"),
+    ("p2sh",   23, b"\xa9\x14", b"\x87"),
+    ("p2wpkh", 22, b"\x00\x14", b""),
+    ("p2wsh",  34, b"\x00\x20", b""),
+    ("p2tr",   34, b"\x51\x20", b""),
+    ("p2pk",   35, b"\x21", b"\xac"),
+    ("p2pk",   67, b"\x41", b"\xac"),
+]
+
+def _templatekinds(codes):
+    """
+    match all bytecode strings against SCRIPT_TEMPLATES at once, using numpy.
+    returns an array with for each script the template index, or -1 when no template matches.
+    """
+    import numpy as np
+    count = len(codes)
+    lens = np.fromiter(map(len, codes), dtype=np.int64, count=count)
+    # padded, so the byte tests of short scripts stay inside the buffer
+    buf = np.frombuffer(b"".join(codes) + bytes(4), dtype=np.uint8)
+    starts = np.zeros(count, dtype=np.int64)
+    np.cumsum(lens[:-1], out=starts[1:])
+    ends = starts + lens
+    # the templates have at most 3 prefix and 2 suffix bytes.
+    heads = [ buf[starts + i] for i in range(3) ]
+    tails = [ buf[np.maximum(ends - i, 0)] for i in (2, 1) ]
+    kinds = np.full(count, -1, dtype=np.int8)
+    for k, (_, n, prefix, suffix) in enumerate(SCRIPT_TEMPLATES):
+        match = lens == n
+        for column, b in zip(heads, prefix):
+            match &= column == b
+        for column, b in zip(tails[2-len(suffix):], suffix):
+            match &= column == b
+        kinds[match] = k
+    return kinds
+
+def classify_scripts(scripts, values=True):
+    """
+    Classify a list of scripts, or bytecode strings.
+    returns a list of ( type, value ) tuples, or with values=False a list of types.
+
+    For the types only, when numpy is available, the standard templates are matched
+    for the whole list at once, and only the other scripts are classified one by one.
+    Extracting the values costs about as much as classifying one script, so with
+    values=True each script is classified by `classify_bytecode`.
+    """
+    codes = [ getattr(s, "bytecode", s) for s in scripts ]
+    if values:
+        return [ classify_bytecode(code) for code in codes ]
+    try:
+        kinds = _templatekinds(codes).tolist() if codes else []
+    except ImportError:
+        return [ classify_bytecode(code)[0] for code in codes ]
+    names = [ t[0] for t in SCRIPT_TEMPLATES ]
+    return [ names[k] if k >= 0 else classify_bytecode(code)[0] for code, k in zip(codes, kinds) ]
+
+def count_script_types(scripts):
+    """ returns a Counter: script type -> number of scripts of that type """
+    return Counter(classify_scripts(scripts, values=False))
+
+
 class Transaction:
     """
     encode, decode an entire transaction.
     """
+    __slots__ = ("version", "inputs", "outputs", "witness", "locktime")
+
     def decode(self, r):
         self.version = r.readdword()
         nrin = r.readvarint()
@@ -145,12 +504,82 @@ class Transaction:
                 wit.encode(w)
         w.writedword(self.locktime)
 
+    @property
+    def basesize(self):
+        """ the size of the transaction without witness data """
+        return 8 + varintsize(len(self.inputs)) + sum(inp.size() for inp in self.inputs) \
+                 + varintsize(len(self.outputs)) + sum(out.size() for out in self.outputs)
+
+    @property
+    def totalsize(self):
+        """ the size of the transaction including witness data """
+        size = self.basesize
+        if self.witness:
+            size += 2 + sum(wit.size() for wit in self.witness)
+        return size
+
+    @property
+    def weight(self):
+        return 3*self.basesize + self.totalsize
+
+    @property
+    def vsize(self):
+        return (self.weight+3)//4
+
+    def legacysigops(self):
+        """ the number of signature operations in the input and output scripts """
+        return sum(inp.script.sigopcount() for inp in self.inputs) + sum(out.script.sigopcount() for out in self.outputs)
+
+    def sigopcost(self, prevouts=None):
+        """
+        the bip141 signature operation cost.
+        Counting the p2sh and witness signature operations needs 'prevouts', the list of spent outputs.
+        """
+        cost = 4*self.legacysigops()
+        if prevouts is None or self.iscoinbase():
+            return cost
+        for i, (inp, prevout) in enumerate(zip(self.inputs, prevouts)):
+            t, program = prevout.script.classify()
+            if t == "p2sh":
+                try:
+                    ops = list(iterops(inp.script.bytecode))
+                except Exception:
+                    continue
+                if not ops or any(op > 0x60 for op, _, _ in ops):
+                    continue
+                # like bitcoin core, the redeemscript is the data of the last push,
+                # a final OP_1NEGATE or OP_1 .. OP_16 leaves it empty.
+                redeem = Script()
+                redeem.bytecode = ops[-1][1] or b""
+                cost += 4*redeem.sigopcount(accurate=True)
+                t, program = redeem.classify()
+            if t == "p2wpkh":
+                cost += 1
+            elif t == "p2wsh" and self.witness and self.witness[i].wstruct:
+                wscript = Script()
+                wscript.bytecode = self.witness[i].witnessscript()
+                cost += wscript.sigopcount(accurate=True)
+        return cost
+
+    def txid(self):
+        """ the transaction hash, in internal byte order """
+        bio = BytesIO()
+        self.encode(Writer(bio), exclude_witness=True)
+        return shasha(bio.getvalue())
+
+    def iscoinbase(self):
+        return len(self.inputs)==1 and self.inputs[0].txn_hash==b"\x00"*32 and self.inputs[0].output_index==0xffffffff
 
     def copy(self):
+        """
+        Copy the transaction, with copies of all inputs and outputs,
+        so these can be modified without changing the original transaction.
+        The scripts and witnesses are shared.
+        """
         t = Transaction()
         t.version = self.version
         t.inputs = [ _.copy() for _ in self.inputs ]
-        t.outputs = self.outputs
+        t.outputs = [ _.copy() for _ in self.outputs ]
         t.witness = self.witness
         t.locktime = self.locktime
         return t